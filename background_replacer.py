@@ -5,22 +5,24 @@ import os
 import math
 from tqdm import tqdm
 import torch
-from PIL import Image, ImageFilter
-from scipy.ndimage import binary_dilation
+from PIL import Image
 import numpy as np
-from captioner import init as init_captioner, derive_caption
-from upscaler import init as init_upscaler
-from segmenter import init as init_segmenter, segment
-from depth_estimator import init as init_depth_estimator, get_depth_map
-from pipeline import init as init_pipeline, run_pipeline
-from image_utils import ensure_resolution, crop_centered
+import model_registry
+import feathering
+from captioner import derive_caption
+from segmenter import segment
+from depth_estimator import get_depth_map
+from pipeline import run_pipeline
+from image_utils import ensure_resolution, shared_canvas, letterbox, unletterbox
+from compositing import Cutout, composite
 
 developer_mode = os.getenv('DEV_MODE', False)
-init_pipeline()
 POSITIVE_PROMPT_SUFFIX = "commercial product photography, 24mm lens f/8"
 NEGATIVE_PROMPT_SUFFIX = "cartoon, drawing, anime, semi-realistic, illustration, painting, art, text, greyscale, (black and white), lens flare, watermark, cropped, out of frame, worst quality, low quality, jpeg artifacts, ugly, duplicate, morbid, mutilated, extra fingers, mutated hands, poorly drawn hands, poorly drawn face, mutation, deformed, dehydrated, bad anatomy, bad proportions, extra limbs, cloned face, disfigured, gross proportions, malformed limbs, missing arms, missing legs, extra arms, extra legs, fused fingers, too many fingers, long neck, floating, levitating"
 
 MEGAPIXELS = 1.0
+STAGES = ["captioning", "resizing", "segmenting", "depth_mapping",
+          "feathering", "generating", "compositing"]
 
 
 def replace_background(
@@ -28,109 +30,177 @@ def replace_background(
     positive_prompt,
     negative_prompt,
     options,
+    progress=None,
 ):
-    pbar = tqdm(total=7)
+    return replace_backgrounds(
+        [original], positive_prompt, negative_prompt, options, progress)[0]
 
-    print("Original size:", original.size)
+
+def replace_backgrounds(
+    originals,
+    positive_prompt,
+    negative_prompt,
+    options,
+    progress=None,
+):
+    """
+    Replaces the background of several images, batching their SDXL calls.
+
+    Every image is captioned, segmented and depth mapped on its own, then all
+    masked depth maps and prompts are sent through the ControlNet pipeline as
+    one batch. The depth maps are letterboxed onto one shared canvas, since
+    a pipeline call generates every image at a single size, and the
+    generated images are cropped and scaled back to each image's own size.
+
+    Args:
+        originals (list[PIL.Image.Image]): The images to process.
+        positive_prompt (str): Prompt appended to each image caption.
+        negative_prompt (str): Prompt prepended to the negative suffix.
+        options (dict): Feathering, seed and candidate options. When
+            `candidate_index` is set, only that candidate is composited.
+        progress (callable, optional): Called as `progress(stage, step=..., total=...)`
+            when each of the `STAGES` starts.
+
+    Returns:
+        list: One `[composited_images, generated_images, pre_processing_images,
+        caption]` entry per input image, in input order.
+    """
+    pbar = tqdm(total=len(STAGES))
+
+    for original in originals:
+        print("Original size:", original.size)
 
     print("Captioning...")
-    init_captioner()
-    caption = derive_caption(original)
+    _report(progress, "captioning")
+    model_registry.ensure("captioner")
+    captions = [derive_caption(original) for original in originals]
     pbar.update(1)
 
-    print("Caption:", caption)
+    print("Captions:", captions)
 
     torch.cuda.empty_cache()
 
     print(f"Ensuring resolution ({MEGAPIXELS}MP)...")
-    resized = ensure_resolution(original, megapixels=MEGAPIXELS)
+    _report(progress, "resizing")
+    resized_images = [ensure_resolution(original, megapixels=MEGAPIXELS)
+                      for original in originals]
     pbar.update(1)
 
-    print("Resized size:", resized.size)
+    print("Resized sizes:", [resized.size for resized in resized_images])
 
     torch.cuda.empty_cache()
 
     print("Segmenting...")
-    init_segmenter()
-    [cropped, crop_mask] = segment(resized)
+    _report(progress, "segmenting")
+    model_registry.ensure("segmenter")
+    segmentations = [segment(resized) for resized in resized_images]
     pbar.update(1)
 
     torch.cuda.empty_cache()
 
     print("Depth mapping...")
-    init_depth_estimator()
-    depth_map = get_depth_map(resized)
+    _report(progress, "depth_mapping")
+    model_registry.ensure("depth_estimator")
+    depth_maps = [get_depth_map(resized) for resized in resized_images]
     pbar.update(1)
 
     torch.cuda.empty_cache()
-    print("Feathering the depth map...")
-    crop_mask_np = np.array(crop_mask.convert('L'))
-    crop_mask_binary = crop_mask_np > options.get(
-        'depth_map_feather_threshold')
-    dilated_mask = binary_dilation(
-        crop_mask_binary, iterations=options.get('depth_map_dilation_iterations'))
-
-    dilated_mask = Image.fromarray((dilated_mask * 255).astype(np.uint8))
-
- 
-    dilated_mask_blurred = dilated_mask.filter(
-        ImageFilter.GaussianBlur(radius=options.get('depth_map_blur_radius')))
-    dilated_mask_blurred_np = np.array(dilated_mask_blurred) / 255.0
-
-    depth_map_np = np.array(depth_map.convert('L')) / 255.0
-    masked_depth_map_np = depth_map_np * dilated_mask_blurred_np
-    masked_depth_map_np = (masked_depth_map_np * 255).astype(np.uint8)
-
-    masked_depth_map = Image.fromarray(masked_depth_map_np).convert('RGB')
-
+    print("Feathering the depth maps...")
+    _report(progress, "feathering")
+    feathered_masks = [
+        feathering.feather_mask(np.asarray(crop_mask), options)
+        for _, crop_mask in segmentations
+    ]
+    masked_depth_maps_np = [
+        feathering.apply_mask(depth_map, dilated_mask_blurred)
+        for depth_map, (_, dilated_mask_blurred) in zip(depth_maps, feathered_masks)
+    ]
     pbar.update(1)
 
-    final_positive_prompt = f"{caption}, {positive_prompt}, {POSITIVE_PROMPT_SUFFIX}"
+    final_positive_prompts = [
+        f"{caption}, {positive_prompt}, {POSITIVE_PROMPT_SUFFIX}" for caption in captions]
     final_negative_prompt = f"{negative_prompt}, {NEGATIVE_PROMPT_SUFFIX}"
 
-    print("Final positive prompt:", final_positive_prompt)
+    print("Final positive prompts:", final_positive_prompts)
     print("Final negative prompt:", final_negative_prompt)
 
     print("Generating...")
-
-    generated_images = run_pipeline(
-        positive_prompt=final_positive_prompt,
-        negative_prompt=final_negative_prompt,
-        image=[masked_depth_map],
-        seed=options.get('seed')
+    _report(progress, "generating")
+    model_registry.ensure("pipeline")
+
+    # Single conversion to the 3-channel PIL conditioning image SDXL expects.
+    masked_depth_maps = [
+        Image.fromarray(masked_depth_map).convert('RGB') for masked_depth_map in masked_depth_maps_np]
+    # The pipeline generates every image of a call at one size. Zero depth
+    # is background, so padding the masked depth maps adds no content.
+    canvas_size = shared_canvas([m.size for m in masked_depth_maps], megapixels=MEGAPIXELS)
+    letterboxed = [letterbox(m, canvas_size) for m in masked_depth_maps]
+    generated_batch = run_pipeline(
+        positive_prompt=final_positive_prompts,
+        negative_prompt=[final_negative_prompt] * len(originals),
+        image=[padded for padded, _ in letterboxed],
+        seed=options.get('seed'),
+        num_images_per_prompt=options.get('num_images_per_prompt', 1)
     )
     pbar.update(1)
 
+    # The pipeline returns the candidates of each prompt contiguously.
+    per_image = len(generated_batch) // len(originals)
+    generated_per_image = [
+        [unletterbox(generated, box, masked_depth_map.size)
+         for generated in generated_batch[i * per_image:(i + 1) * per_image]]
+        for i, (masked_depth_map, (_, box)) in enumerate(zip(masked_depth_maps, letterboxed))
+    ]
+
     torch.cuda.empty_cache()
 
     print("Compositing...")
+    _report(progress, "compositing")
+
+    # With a candidate_index only the candidate that is returned is composited.
+    candidate_index = options.get('candidate_index')
+    if candidate_index is not None:
+        selected_per_image = [
+            generated_images[min(candidate_index, len(generated_images) - 1):][:1]
+            for generated_images in generated_per_image]
+    else:
+        selected_per_image = generated_per_image
 
-    composited_images = [
-        Image.alpha_composite(
-            generated_image.convert('RGBA'),
-            crop_centered(cropped, generated_image.size)
-        ) for generated_image in generated_images
+    composited_per_image = [
+        composite(selected, Cutout(cropped, selected[0].size)) if selected else []
+        for selected, (cropped, _) in zip(selected_per_image, segmentations)
     ]
     pbar.update(1)
     pbar.close()
 
     print("Done!")
 
-    if developer_mode:
-        pre_processing_images = [
-            [resized, "Resized"],
-            [crop_mask, "Crop mask"],
-            [cropped, "Cropped"],
-            [depth_map, "Depth map"],
-            [dilated_mask, "Dilated mask"],
-            [dilated_mask_blurred, "Dilated mask blurred"],
-            [masked_depth_map, "Masked depth map"]
-        ]
-        return [
-            composited_images,
-            generated_images,
-            pre_processing_images,
-            caption,
-        ]
-    else:
-        return [composited_images, None, None, None]
+    results = []
+    for i in range(len(originals)):
+        composited_images = composited_per_image[i]
+        if developer_mode:
+            cropped, crop_mask = segmentations[i]
+            dilated_mask, dilated_mask_blurred = feathered_masks[i]
+            pre_processing_images = [
+                [resized_images[i], "Resized"],
+                [crop_mask, "Crop mask"],
+                [cropped, "Cropped"],
+                [Image.fromarray(depth_maps[i]), "Depth map"],
+                [Image.fromarray(dilated_mask), "Dilated mask"],
+                [Image.fromarray(dilated_mask_blurred), "Dilated mask blurred"],
+                [masked_depth_maps[i], "Masked depth map"]
+            ]
+            results.append([
+                composited_images,
+                generated_per_image[i],
+                pre_processing_images,
+                captions[i],
+            ])
+        else:
+            results.append([composited_images, None, None, None])
+    return results
+
+
+def _report(progress, stage):
+    if progress is not None:
+        progress(stage, step=STAGES.index(stage) + 1, total=len(STAGES))
@@ -0,0 +1,118 @@
+import time
+import threading
+
+
+class _Pending(object):
+    def __init__(self, request, key, size):
+        self.request = request
+        self.key = key
+        self.size = size
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    '''
+    Collects requests from concurrent threads and runs them as batches.
+
+    A batch is dispatched when the requests waiting with the same key add up
+    to `max_batch_size` items, or `max_wait` seconds after its oldest request
+    arrived. Requests are never split, so one larger than `max_batch_size`
+    runs on its own.
+
+    `run_batch(requests)` must return one result per request, in order. The
+    batching policy does not depend on the model, so it can be exercised on
+    CPU with any stand-in `run_batch`.
+    '''
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait=0.05,
+                 size_of=lambda request: 1, key_of=lambda request: None):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.size_of = size_of
+        self.key_of = key_of
+        self._queue = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {"batches": 0, "requests": 0, "items": 0, "max_items": 0}
+
+    def submit(self, request):
+        """
+        Queues a request and blocks until its batch has run.
+
+        Returns:
+            The result `run_batch` produced for this request.
+
+        Raises:
+            Exception: Whatever `run_batch` raised for the batch.
+        """
+        pending = _Pending(request, self.key_of(request), self.size_of(request))
+        with self._cond:
+            self._ensure_thread()
+            self._queue.append(pending)
+            self._cond.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+        stats["mean_items"] = stats["items"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+            self._thread.start()
+
+    def _select(self):
+        first = self._queue[0]
+        batch, size = [], 0
+        for pending in self._queue:
+            if pending.key != first.key:
+                continue
+            if batch and size + pending.size > self.max_batch_size:
+                break
+            batch.append(pending)
+            size += pending.size
+        return batch, size
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0].enqueued + self.max_wait
+            while True:
+                batch, size = self._select()
+                remaining = deadline - time.monotonic()
+                if size >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            for pending in batch:
+                self._queue.remove(pending)
+            self._stats["batches"] += 1
+            self._stats["requests"] += len(batch)
+            self._stats["items"] += size
+            self._stats["max_items"] = max(self._stats["max_items"], size)
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.run_batch([pending.request for pending in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"run_batch returned {len(results)} results for {len(batch)} requests")
+                for pending, result in zip(batch, results):
+                    pending.result = result
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            for pending in batch:
+                pending.done.set()
@@ -0,0 +1,80 @@
+"""
+Compares the feathering engine against the original scipy + PIL implementation.
+
+Run from the repository root:
+    python benchmarks/feathering.py [--size 1024] [--runs 20]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image, ImageFilter
+from scipy.ndimage import binary_dilation
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feathering  # noqa: E402
+
+OPTIONS = {
+    'depth_map_feather_threshold': 128,
+    'depth_map_dilation_iterations': 10,
+    'depth_map_blur_radius': 10,
+}
+
+
+def legacy_feather(mask, depth_map, options):
+    binary = mask > options.get('depth_map_feather_threshold')
+    dilated = binary_dilation(binary, iterations=options.get('depth_map_dilation_iterations'))
+    dilated = Image.fromarray((dilated * 255).astype(np.uint8))
+    blurred = dilated.filter(ImageFilter.GaussianBlur(radius=options.get('depth_map_blur_radius')))
+    blurred_np = np.array(blurred) / 255.0
+    masked = (depth_map / 255.0) * blurred_np
+    return np.array(dilated), np.array(blurred), (masked * 255).astype(np.uint8)
+
+
+def new_feather(mask, depth_map, options):
+    dilated, blurred = feathering.feather_mask(mask, options)
+    return dilated, blurred, feathering.apply_mask(depth_map, blurred)
+
+
+def synthetic_inputs(size):
+    yy, xx = np.mgrid[0:size, 0:size]
+    centre = size / 2
+    radius = np.hypot((yy - centre) / 1.4, xx - centre)
+    mask = np.clip(255 - (radius - size / 4) * 8, 0, 255).astype(np.uint8)
+    depth_map = np.random.randint(0, 256, (size, size), dtype=np.uint8)
+    return mask, depth_map
+
+
+def time_per_image(fn, runs, *args):
+    fn(*args)
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(*args)
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    mask, depth_map = synthetic_inputs(args.size)
+
+    legacy = legacy_feather(mask, depth_map, OPTIONS)
+    new = new_feather(mask, depth_map, OPTIONS)
+    for name, a, b in zip(["dilated", "blurred", "masked depth"], legacy, new):
+        diff = np.abs(a.astype(np.int16) - b.astype(np.int16))
+        print(f"{name}: max abs diff {diff.max()}, mean abs diff {diff.mean():.4f}")
+
+    legacy_time = time_per_image(legacy_feather, args.runs, mask, depth_map, OPTIONS)
+    new_time = time_per_image(new_feather, args.runs, mask, depth_map, OPTIONS)
+    print(f"legacy: {legacy_time * 1000:.2f} ms/image")
+    print(f"new:    {new_time * 1000:.2f} ms/image")
+    print(f"saved:  {(legacy_time - new_time) * 1000:.2f} ms/image ({legacy_time / new_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
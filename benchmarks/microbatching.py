@@ -0,0 +1,94 @@
+"""
+Exercises the SDXL micro-batching policy on CPU with a tiny stand-in model.
+
+Several threads submit requests concurrently, as the threads of a gpu worker
+would; the script reports the batches formed and the throughput compared
+with running every request on its own.
+
+Run from the repository root:
+    python benchmarks/microbatching.py [--threads 8] [--requests 32] [--window-ms 20] [--max-batch 4]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher  # noqa: E402
+
+
+class TinyDenoiser(nn.Module):
+    def __init__(self):
+        super(TinyDenoiser, self).__init__()
+        self.net = nn.Sequential(
+            nn.Conv2d(4, 32, 3, padding=1), nn.ReLU(),
+            nn.Conv2d(32, 32, 3, padding=1), nn.ReLU(),
+            nn.Conv2d(32, 4, 3, padding=1))
+
+    def forward(self, x, steps=10):
+        for _ in range(steps):
+            x = x - 0.1 * self.net(x)
+        return x
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=20)
+    parser.add_argument("--max-batch", type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    model = TinyDenoiser().eval()
+    inputs = [torch.randn(1, 4, 64, 64) for _ in range(args.requests)]
+
+    def run_batch(requests):
+        with torch.no_grad():
+            out = model(torch.cat(requests))
+        return list(out.split(1))
+
+    with torch.no_grad():
+        expected = [model(x) for x in inputs]
+
+    start = time.perf_counter()
+    for x in inputs:
+        run_batch([x])
+    sequential = time.perf_counter() - start
+
+    batcher = MicroBatcher(run_batch, max_batch_size=args.max_batch,
+                           max_wait=args.window_ms / 1000.0,
+                           size_of=lambda x: x.shape[0])
+    results = [None] * args.requests
+    next_index = iter(range(args.requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            results[i] = batcher.submit(inputs[i])
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batched = time.perf_counter() - start
+
+    max_error = max((r - e).abs().max().item() for r, e in zip(results, expected))
+    print("outputs routed back correctly:", max_error < 1e-4, f"(max error {max_error:.2e})")
+    print("batcher:", batcher.stats())
+    print(f"unbatched: {sequential * 1000 / args.requests:.2f} ms/request")
+    print(f"batched:   {batched * 1000 / args.requests:.2f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
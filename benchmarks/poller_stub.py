@@ -0,0 +1,99 @@
+"""
+Runs the try-on poller against the local API stub.
+
+Starts `kling_stub` in-process, submits a batch of try-on tasks to it, and
+polls them all with one `KlingPoller`, streaming each result into a
+temporary blob store. Reports completions, poll counts and wall time.
+
+Run from the repository root:
+    python benchmarks/poller_stub.py [--tasks 200] [--delay 3] [--min-interval 0.5] [--max-interval 5]
+"""
+import os
+import sys
+import time
+import base64
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start_stub(port):
+    import uvicorn
+    import kling_stub
+
+    server = uvicorn.Server(uvicorn.Config(kling_stub.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run(args, try_on_url):
+    import aiohttp
+    import downloads
+    from kling_poller import KlingPoller, fetch_kling_status
+
+    image = b"\x89PNG\r\n\x1a\n" + os.urandom(args.image_kb * 1024)
+    payload = {"human_image": base64.b64encode(image).decode()}
+    done = {}
+    finished = asyncio.Event()
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=64)) as session:
+        remote_ids = []
+        for _ in range(args.tasks):
+            async with session.post(try_on_url, json=payload) as response:
+                remote_ids.append((await response.json())["data"]["task_id"])
+
+        async def on_done(context, result, error):
+            downloaded = None
+            if result:
+                downloaded = await downloads.download_to_store_async(session, result["images"][0]["url"])
+            done[context["remote_task_id"]] = (error, downloaded)
+            if len(done) == len(remote_ids):
+                finished.set()
+
+        poller = KlingPoller(
+            lambda remote_task_id: fetch_kling_status(session, remote_task_id, try_on_url, "stub"),
+            on_done, min_interval=args.min_interval, max_interval=args.max_interval,
+            timeout=args.delay * 4 + 30)
+        for remote_task_id in remote_ids:
+            poller.submit(remote_task_id, {"remote_task_id": remote_task_id})
+
+        start = time.perf_counter()
+        runner = asyncio.ensure_future(poller.run())
+        try:
+            await asyncio.wait_for(finished.wait(), timeout=args.delay * 4 + 60)
+        finally:
+            runner.cancel()
+        elapsed = time.perf_counter() - start
+
+    failed = [error for error, downloaded in done.values() if error or downloaded is None]
+    print(f"tasks completed: {len(done) - len(failed)}/{args.tasks}, failed: {len(failed)}")
+    print(f"polls: {poller.polls} ({poller.polls / args.tasks:.1f} per task)")
+    print(f"wall time: {elapsed:.2f}s for a {args.delay:.1f}s remote delay")
+    print("downloads:", downloads.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=3.0, help="Seconds until a stub task succeeds.")
+    parser.add_argument("--min-interval", type=float, default=0.5)
+    parser.add_argument("--max-interval", type=float, default=5.0)
+    parser.add_argument("--image-kb", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    # Both are read at import time.
+    os.environ["KLING_STUB_DELAY"] = str(args.delay)
+    os.environ["BLOB_STORE_DIR"] = tempfile.mkdtemp()
+
+    start_stub(args.port)
+    asyncio.run(run(args, f"http://127.0.0.1:{args.port}/v1/images/kolors-virtual-try-on"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares latency, peak memory and mask error of the segmenter in fp32 and in
+reduced precision (bf16 autocast on CPU, fp16 on GPU, BatchNorm kept in fp32).
+
+Each precision runs in its own process so the peak memory figures are
+independent. Run from the repository root:
+    python benchmarks/segmenter_precision.py [--size 1024] [--runs 5] [--weights saved_models/isnet-general-use.pth]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models  # noqa: E402
+import segmenter  # noqa: E402
+
+
+def build(weights, digit, device):
+    torch.manual_seed(0)
+    net = models.ISNetDIS(inference_only=True)
+    if weights:
+        net.load_state_dict(torch.load(weights, map_location="cpu"))
+    if digit == "half":
+        segmenter.keep_norm_fp32(net)
+    return net.to(device).eval()
+
+
+def run(args):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    net = build(args.weights, args.digit, device)
+    torch.manual_seed(1)
+    image = (torch.rand(1, 3, args.size, args.size) - 0.5).to(device)
+    half = args.digit == "half"
+
+    def forward():
+        with torch.no_grad(), torch.autocast(device, dtype=segmenter.autocast_dtype(device), enabled=half):
+            return net(image).float()
+
+    mask = forward()
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        forward()
+    if device == "cuda":
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    torch.save(mask.cpu(), args.mask_out)
+    print(json.dumps({"device": device, "latency": (time.perf_counter() - start) / args.runs, "peak_mb": peak}))
+
+
+def measure(args, digit, mask_out):
+    command = [sys.executable, os.path.abspath(__file__), "--digit", digit, "--size", str(args.size),
+               "--runs", str(args.runs), "--mask-out", mask_out]
+    if args.weights:
+        command += ["--weights", args.weights]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--weights", default="")
+    parser.add_argument("--digit", default="")
+    parser.add_argument("--mask-out", default="")
+    args = parser.parse_args()
+
+    if args.digit:
+        run(args)
+        return
+
+    workdir = tempfile.mkdtemp()
+    full = measure(args, "full", os.path.join(workdir, "full.pt"))
+    half = measure(args, "half", os.path.join(workdir, "half.pt"))
+    full_mask = torch.load(os.path.join(workdir, "full.pt"))
+    half_mask = torch.load(os.path.join(workdir, "half.pt"))
+    low = "fp16" if full["device"] == "cuda" else "bf16"
+    memory = "peak allocated" if full["device"] == "cuda" else "peak RSS"
+
+    print(f"device: {full['device']}, input {args.size}x{args.size}")
+    print(f"fp32:   {full['latency'] * 1000:8.1f} ms/image, {memory} {full['peak_mb']:8.1f} MiB")
+    print(f"{low}:   {half['latency'] * 1000:8.1f} ms/image, {memory} {half['peak_mb']:8.1f} MiB")
+    print(f"speedup: {full['latency'] / half['latency']:.2f}x, "
+          f"memory saved: {full['peak_mb'] - half['peak_mb']:.1f} MiB")
+    print("mask max abs difference:", (full_mask - half_mask).abs().max().item())
+    print("mask mean abs difference:", (full_mask - half_mask).abs().mean().item())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compares the per-image CPU time of the ISNet input preprocessing paths.
+
+Run from the repository root:
+    python benchmarks/segmenter_preprocess.py [--width 1024] [--height 1024] [--runs 20]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segmenter  # noqa: E402
+from data_loader_cache import im_preprocess, normalize  # noqa: E402
+
+SIZE = [1024, 1024]
+
+
+def legacy_path(im):
+    segmenter.normalize = normalize
+    tensor, shape = im_preprocess(im, SIZE)
+    tensor = torch.divide(tensor, 255.0)
+    return segmenter.transform(tensor).unsqueeze(0), torch.from_numpy(np.array(shape)).unsqueeze(0)
+
+
+def fused_path(im):
+    return segmenter.preprocess([im], SIZE)
+
+
+def time_per_image(fn, im, runs):
+    fn(im)
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(im)
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    im = np.random.randint(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+
+    legacy, legacy_shape = legacy_path(im)
+    fused, fused_shape = fused_path(im)
+    print("max abs difference:", (legacy - fused).abs().max().item())
+    print("shapes equal:", torch.equal(legacy_shape, fused_shape))
+
+    legacy_time = time_per_image(legacy_path, im, args.runs)
+    fused_time = time_per_image(fused_path, im, args.runs)
+    print(f"legacy: {legacy_time * 1000:.2f} ms/image")
+    print(f"fused:  {fused_time * 1000:.2f} ms/image")
+    print(f"saved:  {(legacy_time - fused_time) * 1000:.2f} ms/image ({legacy_time / fused_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
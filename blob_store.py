@@ -0,0 +1,137 @@
+import os
+import mmap
+import time
+import hashlib
+import tempfile
+import threading
+import numpy as np
+
+# Content-addressed filesystem store shared by the API and the workers.
+# Blobs are named by their BLAKE2b digest (the same digest as
+# `content_hash.hash_bytes`) and expire BLOB_TTL seconds after their last write.
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "blobs")
+BLOB_TTL = int(os.getenv("BLOB_TTL", 24 * 3600))
+PURGE_INTERVAL = 600
+
+_last_purge = 0.0
+_purge_lock = threading.Lock()
+
+
+def blob_path(ref):
+    """Returns the file path of a blob, sharded by the first two hex digits."""
+    if not ref or not all(c in "0123456789abcdef" for c in ref):
+        raise ValueError(f"Invalid blob reference: {ref!r}")
+    return os.path.join(BLOB_STORE_DIR, ref[:2], ref)
+
+
+class BlobWriter(object):
+    '''
+    Streams data into a temporary file while hashing it, then moves it into
+    place under its content hash.
+    '''
+
+    def __init__(self):
+        os.makedirs(BLOB_STORE_DIR, exist_ok=True)
+        self._digest = hashlib.blake2b(digest_size=20)
+        self.size = 0
+        fd, self._tmp_path = tempfile.mkstemp(dir=BLOB_STORE_DIR, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self._digest.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """
+        Finishes the blob.
+
+        Returns:
+            str: The blob reference (hex content hash).
+        """
+        self._file.close()
+        ref = self._digest.hexdigest()
+        path = blob_path(ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+            os.utime(path)
+        else:
+            os.replace(self._tmp_path, path)
+        return ref
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def put(data):
+    """Stores bytes and returns their blob reference."""
+    writer = BlobWriter()
+    try:
+        writer.write(data)
+    except Exception:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+def put_array(array):
+    """Stores a numpy array in `.npy` format and returns its blob reference."""
+    writer = BlobWriter()
+    try:
+        np.lib.format.write_array(writer, np.ascontiguousarray(array), allow_pickle=False)
+    except Exception:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+def open_array(ref):
+    """Memory-maps an array stored with `put_array` without reading it into memory."""
+    return np.load(blob_path(ref), mmap_mode="r", allow_pickle=False)
+
+
+def open_blob(ref):
+    """
+    Memory-maps a blob read-only.
+
+    The returned `mmap` supports the buffer protocol and file-style
+    `read`/`seek`, so it can be hashed or decoded without copying it into
+    a bytes object. Close it when done.
+
+    Raises:
+        FileNotFoundError: If the blob does not exist or has expired.
+    """
+    with open(blob_path(ref), "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def purge_expired(force=False):
+    """
+    Deletes blobs older than `BLOB_TTL`, at most once every `PURGE_INTERVAL`
+    seconds unless `force` is set.
+
+    It walks the whole store, so it is run as a periodic job by the API
+    (see `main.purge_blobs_periodically`), never on the request path.
+    """
+    global _last_purge
+
+    now = time.time()
+    if not force and now - _last_purge < PURGE_INTERVAL:
+        return
+    if not _purge_lock.acquire(blocking=False):
+        return
+    try:
+        _last_purge = now
+        for root, _, files in os.walk(BLOB_STORE_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if now - os.path.getmtime(path) > BLOB_TTL:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+    finally:
+        _purge_lock.release()
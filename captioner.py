@@ -1,11 +1,24 @@
+import os
 from transformers import pipeline
+from content_hash import hash_image
+from lru_cache import LRUCache
 
 captioner = None
 PROMPT = "The main subject of this picture is a"
 
+# Captions are cached per image content. The Redis tier is shared by workers
+# and only used when CAPTION_CACHE_REDIS_URL is set.
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", 1024))
+CAPTION_CACHE_REDIS_URL = os.getenv("CAPTION_CACHE_REDIS_URL")
+CAPTION_CACHE_TTL = int(os.getenv("CAPTION_CACHE_TTL", 7 * 24 * 3600))
+CAPTION_CACHE_KEY_PREFIX = "caption:"
+
+caption_cache = LRUCache(CAPTION_CACHE_SIZE)
+redis_client = None
+
 
 def init():
-    global captioner
+    global captioner, redis_client
 
     print("Initializing captioner...")
 
@@ -15,9 +28,48 @@ def init():
         prompt=PROMPT
     )
 
+    if CAPTION_CACHE_REDIS_URL:
+        import redis
+        redis_client = redis.Redis.from_url(
+            CAPTION_CACHE_REDIS_URL, decode_responses=True)
+
+
+def _redis_get(key):
+    if redis_client is None:
+        return None
+    try:
+        return redis_client.get(CAPTION_CACHE_KEY_PREFIX + key)
+    except Exception as e:
+        print(f"Caption cache Redis lookup failed: {e}")
+        return None
+
+
+def _redis_set(key, caption):
+    if redis_client is None:
+        return
+    try:
+        redis_client.set(CAPTION_CACHE_KEY_PREFIX + key,
+                         caption, ex=CAPTION_CACHE_TTL)
+    except Exception as e:
+        print(f"Caption cache Redis store failed: {e}")
+
 
 def derive_caption(image):
+    key = hash_image(image)
+
+    caption = caption_cache.get(key)
+    if caption is not None:
+        return caption
+
+    caption = _redis_get(key)
+    if caption is not None:
+        caption_cache.put(key, caption)
+        return caption
+
     result = captioner(image, max_new_tokens=20)
     raw_caption = result[0]["generated_text"]
     caption = raw_caption.lower().replace(PROMPT.lower(), "").strip()
+
+    caption_cache.put(key, caption)
+    _redis_set(key, caption)
     return caption
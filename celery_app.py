@@ -6,10 +6,23 @@ celery = Celery(
     backend="redis://localhost:6379/0"
 )
 
+# CPU preprocessing, model inference and external API I/O each get their own
+# queue so every worker pool can be sized and scaled independently.
+TASK_ROUTES = {
+    "tasks.image_processing": {"queue": "cpu"},
+    "tasks.generate_backgrounds": {"queue": "gpu"},
+    "tasks.try_on_images": {"queue": "io"},
+    "tasks.complete_try_on": {"queue": "io"},
+}
+
 celery.conf.update(
     task_serializer="json",
     accept_content=["json"],
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    task_routes=TASK_ROUTES,
+    # Long model and remote-API tasks should not be prefetched behind each other.
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
 )
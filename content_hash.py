@@ -0,0 +1,21 @@
+import hashlib
+
+
+def hash_bytes(data):
+    """Returns the hex BLAKE2b digest of raw bytes, e.g. an uploaded file."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def hash_image(image):
+    """
+    Returns a content hash of a PIL image's decoded pixels.
+
+    Hashing the pixels rather than the file makes the same photo re-encoded
+    losslessly or re-uploaded under another name hash the same. The mode and
+    size are part of the key so images of different shapes whose raw bytes
+    happen to match do not collide.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
@@ -1,6 +1,4 @@
 import torch
-import numpy as np
-from PIL import Image
 from transformers import DPTFeatureExtractor, DPTForDepthEstimation
 torch.multiprocessing.set_start_method('spawn', force=True) 
 device = None
@@ -22,6 +20,13 @@ def init():
 
 
 def get_depth_map(image):
+    """
+    Estimates a depth map at the size of `image`.
+
+    Returns:
+        numpy.ndarray: A single-channel uint8 array of shape (height, width),
+        normalized so the nearest point is 255.
+    """
     original_size = image.size
 
     image = feature_extractor(
@@ -40,9 +45,6 @@ def get_depth_map(image):
     depth_min = torch.amin(depth_map, dim=[1, 2, 3], keepdim=True)
     depth_max = torch.amax(depth_map, dim=[1, 2, 3], keepdim=True)
     depth_map = (depth_map - depth_min) / (depth_max - depth_min)
-    image = torch.cat([depth_map] * 3, dim=1)
-
-    image = image.permute(0, 2, 3, 1).cpu().numpy()[0]
-    image = Image.fromarray((image * 255.0).clip(0, 255).astype(np.uint8))
+    depth_map = (depth_map[0, 0].float() * 255.0).clamp_(0, 255).to(torch.uint8)
 
-    return image
+    return depth_map.cpu().numpy()
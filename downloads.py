@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+import mimetypes
+import threading
+import blob_store
+import http_client
+
+# Streaming downloads of try-on results into the output store. Chunks are
+# written to a temporary file and only renamed into place once the body is
+# complete and matches its Content-Length.
+CHUNK_SIZE = 64 * 1024
+
+_stats = {"downloads": 0, "failures": 0, "bytes": 0, "seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+def content_type_for(url, header=None):
+    """Prefers an image Content-Type header, falling back to the URL extension."""
+    if header and header.split(";")[0].strip().startswith("image/"):
+        return header.split(";")[0].strip()
+    ext = os.path.splitext(url)[-1].split('?')[0] or ".png"
+    return mimetypes.types_map.get(ext.lower(), "application/octet-stream")
+
+
+def _identity_length(headers):
+    # Compressed bodies are decoded while streaming, so only identity ones can be checked.
+    if headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    return headers.get("Content-Length")
+
+
+def _check_length(writer, expected):
+    if writer.size == 0:
+        raise IncompleteDownload("Empty response body")
+    if expected is not None and writer.size != int(expected):
+        raise IncompleteDownload(f"Received {writer.size} of {expected} bytes")
+
+
+def _record(size, seconds, failed=False):
+    with _stats_lock:
+        if failed:
+            _stats["failures"] += 1
+            return
+        _stats["downloads"] += 1
+        _stats["bytes"] += size
+        _stats["seconds"] += seconds
+    print(f"Downloaded {size / 1024:.0f} KiB in {seconds:.2f}s "
+          f"({size / max(seconds, 1e-6) / 1024 / 1024:.2f} MiB/s)")
+
+
+def download_to_store(url):
+    """
+    Streams a URL into the blob store.
+
+    Args:
+        url (str): The image URL.
+
+    Returns:
+        tuple: (blob reference, content type), or None if the download failed.
+    """
+    start = time.perf_counter()
+    writer = blob_store.BlobWriter()
+    try:
+        with http_client.get(url, stream=True) as response:
+            if response.status_code != 200:
+                raise IncompleteDownload(f"Status code {response.status_code}")
+            for chunk in response.iter_content(CHUNK_SIZE):
+                writer.write(chunk)
+            _check_length(writer, _identity_length(response.headers))
+            content_type = content_type_for(url, response.headers.get("Content-Type"))
+    except Exception as e:
+        writer.abort()
+        _record(0, 0, failed=True)
+        print(f"Failed to download image: {e}")
+        return None
+    ref = writer.commit()
+    _record(writer.size, time.perf_counter() - start)
+    return ref, content_type
+
+
+async def download_to_store_async(session, url):
+    """
+    Streams a URL into the blob store with an aiohttp session.
+
+    The body is received on the event loop; file I/O runs in a worker thread
+    so other coroutines, e.g. the poller's other polls, are not stalled.
+
+    Returns:
+        tuple: (blob reference, content type), or None if the download failed.
+    """
+    start = time.perf_counter()
+    writer = await asyncio.to_thread(blob_store.BlobWriter)
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise IncompleteDownload(f"Status code {response.status}")
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                await asyncio.to_thread(writer.write, chunk)
+            _check_length(writer, _identity_length(response.headers))
+            content_type = content_type_for(url, response.headers.get("Content-Type"))
+        ref = await asyncio.to_thread(writer.commit)
+    except Exception as e:
+        await asyncio.to_thread(writer.abort)
+        _record(0, 0, failed=True)
+        print(f"Failed to download image: {e}")
+        return None
+    _record(writer.size, time.perf_counter() - start)
+    return ref, content_type
+
+
+def stats():
+    """Returns download counts, bytes, total seconds and mean throughput in bytes per second."""
+    with _stats_lock:
+        result = dict(_stats)
+    result["throughput"] = result["bytes"] / result["seconds"] if result["seconds"] else 0.0
+    return result
@@ -1,7 +1,6 @@
 import cv2
 import numpy as np
 import mediapipe as mp
-import base64
 import os
 mp_face_detection = mp.solutions.face_detection
 
@@ -13,7 +12,7 @@ def face_detect_and_crop(image):
         image (numpy.ndarray): The input image in BGR format.
 
     Returns:
-        str: Base64-encoded cropped image. If no face is detected, returns the full image.
+        numpy.ndarray: The cropped image in BGR format. If no face is detected, returns the full image.
     
     Raises:
         ValueError: If the input image is invalid.
@@ -38,9 +37,7 @@ def face_detect_and_crop(image):
                 break 
         else:
             body_image = image  
-    _, buffer = cv2.imencode(".jpg", body_image)
-    base64_encoded_data = base64.b64encode(buffer).decode("utf-8")
-    return base64_encoded_data
+    return body_image
 
 def process_cropping(target_image):
     """
@@ -50,9 +47,9 @@ def process_cropping(target_image):
         target_image (PIL.Image.Image): The target image to process.
 
     Returns:
-        str: The base64-encoded cropped image.
+        numpy.ndarray: The cropped image in RGB format, encoded later by `image_encoding`.
     """
-    image=cv2.cvtColor(np.array(target_image), cv2.COLOR_RGB2BGR)
-    processed_image_base64= face_detect_and_crop(image)
-    return processed_image_base64
+    image=cv2.cvtColor(np.array(target_image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    cropped_image = face_detect_and_crop(image)
+    return cv2.cvtColor(cropped_image, cv2.COLOR_BGR2RGB)
 
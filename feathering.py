@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+
+def dilate(mask, iterations):
+    """
+    Dilates a boolean mask by `iterations` steps of the 4-connected cross.
+
+    Gives the same result as `scipy.ndimage.binary_dilation(mask,
+    iterations=iterations)`, but in a single pass: a pixel is set when its
+    L1 distance to the mask is at most `iterations`.
+
+    Args:
+        mask (numpy.ndarray): A 2D boolean mask.
+        iterations (int): The dilation radius. Values below 1 grow the
+            mask until it stops changing, like scipy.
+
+    Returns:
+        numpy.ndarray: The dilated boolean mask.
+    """
+    if not mask.any():
+        return np.zeros_like(mask, dtype=bool)
+    if iterations < 1:
+        return np.ones_like(mask, dtype=bool)
+
+    background = np.logical_not(mask).view(np.uint8)
+    distance = cv2.distanceTransform(background, cv2.DIST_L1, cv2.DIST_MASK_3)
+    return distance <= iterations
+
+
+def blur(mask, radius):
+    """Separable Gaussian blur of a uint8 mask with standard deviation `radius`."""
+    if radius <= 0:
+        return mask.copy()
+    return cv2.GaussianBlur(mask, (0, 0), sigmaX=radius, sigmaY=radius,
+                            borderType=cv2.BORDER_REPLICATE)
+
+
+def feather_mask(mask, options):
+    """
+    Thresholds, dilates and blurs a segmentation mask.
+
+    Args:
+        mask (numpy.ndarray): A uint8 mask of shape (height, width).
+        options (dict): Uses `depth_map_feather_threshold`,
+            `depth_map_dilation_iterations` and `depth_map_blur_radius`.
+
+    Returns:
+        tuple: The dilated and the blurred masks as uint8 arrays in [0, 255].
+    """
+    binary = mask > options.get('depth_map_feather_threshold')
+    dilated = dilate(binary, options.get('depth_map_dilation_iterations'))
+    dilated = dilated.view(np.uint8) * np.uint8(255)
+    return dilated, blur(dilated, options.get('depth_map_blur_radius'))
+
+
+def apply_mask(image, mask):
+    """Returns `image * mask / 255` for uint8 arrays, computed in integer arithmetic."""
+    masked = np.multiply(image, mask, dtype=np.uint16)
+    masked //= 255
+    return masked.astype(np.uint8)
@@ -0,0 +1,171 @@
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Shared keep-alive session for the try-on API. Connections are pooled per
+# host and reused across requests and worker threads.
+POOL_MAXSIZE = 32
+MAX_PER_HOST = 16
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+_stats = {"requests": 0, "retries": 0}
+_stats_lock = threading.Lock()
+
+
+def session():
+    """Returns the process-wide pooled `requests.Session`."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def _host_limit(url):
+    host = urlsplit(url).netloc
+    with _session_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_limits[host]
+
+
+def _not_sent(error):
+    """True if the request failed before any of it reached the server."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _release_on_close(response, limit):
+    """Releases `limit` once a streamed response is closed."""
+    close = response.close
+    released = threading.Event()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released.is_set():
+                released.set()
+                limit.release()
+
+    response.close = close_and_release
+
+
+def _backoff(attempt):
+    # Full jitter: spreads retries from many threads instead of synchronizing them.
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method, url, timeout=None, retries=MAX_RETRIES, **kwargs):
+    """
+    Sends a request through the shared session.
+
+    Idempotent methods are retried on connection errors, timeouts and
+    retryable status codes; other methods only when the connection could
+    not be established, so a request is never sent twice.
+
+    Requests count against the per-host limit until their response has been
+    read; with `stream=True`, until the response is closed, so callers must
+    close it (e.g. use it as a context manager).
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The request URL.
+        timeout (float or tuple, optional): Defaults to (CONNECT_TIMEOUT, READ_TIMEOUT).
+        retries (int): Retries after the first attempt.
+        **kwargs: Passed to `requests.Session.request`.
+
+    Returns:
+        requests.Response: The last response received.
+
+    Raises:
+        requests.RequestException: If every attempt failed without a response.
+    """
+    method = method.upper()
+    idempotent = method in IDEMPOTENT_METHODS
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    limit = _host_limit(url)
+
+    attempt = 0
+    while True:
+        with _stats_lock:
+            _stats["requests"] += 1
+        limit.acquire()
+        try:
+            response = session().request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            limit.release()
+            if attempt >= retries or not (idempotent or _not_sent(e)):
+                raise
+            print(f"{method} {url} failed ({e}), retrying...")
+        except BaseException:
+            limit.release()
+            raise
+        else:
+            if kwargs.get("stream"):
+                _release_on_close(response, limit)
+            else:
+                limit.release()
+            if not (idempotent and response.status_code in RETRY_STATUSES) or attempt >= retries:
+                return response
+            if kwargs.get("stream"):
+                response.close()
+            print(f"{method} {url} returned {response.status_code}, retrying...")
+        with _stats_lock:
+            _stats["retries"] += 1
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def stats():
+    """
+    Returns request, retry and connection counts of the shared session.
+
+    `connection_reuse` is the fraction of requests that did not need a new
+    TCP/TLS connection.
+    """
+    connections = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+    with _stats_lock:
+        requests_sent = _stats["requests"]
+        retries = _stats["retries"]
+    return {
+        "requests": requests_sent,
+        "retries": retries,
+        "connections_opened": connections,
+        "connection_reuse": 1 - connections / requests_sent if requests_sent else 0.0,
+    }
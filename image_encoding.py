@@ -0,0 +1,89 @@
+import os
+import io
+import json
+import base64
+import numpy as np
+from PIL import Image
+
+# Encoding tiers for images sent to the remote try-on API.
+TIERS = {
+    "lossless": {"format": "PNG", "params": {"compress_level": 1}},
+    "high": {"format": "JPEG", "params": {"quality": 95, "subsampling": 0}},
+    "standard": {"format": "JPEG", "params": {"quality": 90}},
+    "compact": {"format": "WEBP", "params": {"quality": 85, "method": 4}},
+}
+ENCODING_TIER = os.getenv("TRY_ON_ENCODING_TIER", "standard")
+# Longest side sent to the try-on model; larger images are downscaled.
+MAX_DIMENSION = int(os.getenv("TRY_ON_MAX_DIMENSION", 1024))
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+
+def encode_image(image, tier=None, max_dimension=None):
+    """
+    Encodes an image once, in the format and quality of an encoding tier.
+
+    Args:
+        image (PIL.Image.Image or numpy.ndarray): The image, as PIL or an RGB array.
+        tier (str, optional): A key of `TIERS`. Defaults to `ENCODING_TIER`.
+        max_dimension (int, optional): Longest side after downscaling.
+            Defaults to `MAX_DIMENSION`.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    settings = TIERS[tier or ENCODING_TIER]
+    max_dimension = max_dimension or MAX_DIMENSION
+
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_dimension:
+        scale = max_dimension / max(image.size)
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=settings["format"], **settings["params"])
+    return buffer.getvalue()
+
+
+class StreamingJSONBody(object):
+    '''
+    A JSON object request body whose `bytes` values are base64-encoded while
+    the body is sent, so no base64 string or serialized JSON copy of the
+    images is ever built.
+
+    It has a length, so `requests` sends a Content-Length instead of chunked
+    encoding, and it can be iterated again when a request is retried.
+    '''
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def _parts(self):
+        yield b"{"
+        for i, (key, value) in enumerate(self.fields.items()):
+            yield (", " if i else "").encode() + json.dumps(key).encode() + b": "
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                yield b'"'
+                for start in range(0, len(value), BASE64_CHUNK_SIZE):
+                    yield base64.b64encode(value[start:start + BASE64_CHUNK_SIZE])
+                yield b'"'
+            else:
+                yield json.dumps(value).encode()
+        yield b"}"
+
+    def __iter__(self):
+        return self._parts()
+
+    def __len__(self):
+        length = 0
+        for i, (key, value) in enumerate(self.fields.items()):
+            length += (2 if i else 0) + len(json.dumps(key).encode()) + 2
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                length += 2 + 4 * ((len(value) + 2) // 3)
+            else:
+                length += len(json.dumps(value).encode())
+        return length + 2
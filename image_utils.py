@@ -1,7 +1,8 @@
 import math
 from PIL import Image
 
-from upscaler import upscale, init as upscale_init
+import model_registry
+from upscaler import upscale
 
 UPSCALE_PIXEL_THRESHOLD = 1
 DOWNSCALE_PIXEL_THRESHOLD = 1
@@ -19,7 +20,7 @@ def maybe_upscale(original, megapixels=1.0):
 
         if (target_width - original_width >= 1 or target_height - original_height >= UPSCALE_PIXEL_THRESHOLD):
             print("Upscaling...")
-            upscale_init()
+            model_registry.ensure("upscaler")
             upscaled = upscale(original)
 
             print("Upscaled size:", upscaled.size)
@@ -71,3 +72,43 @@ def crop_centered(image, target_size):
     bottom = (original_height + target_height) / 2
 
     return image.crop((left, top, right, bottom))
+
+
+def shared_canvas(sizes, megapixels=1.0, multiple=8):
+    """
+    Returns a (width, height) of about `megapixels` for a batch of images,
+    with the geometric mean of their aspect ratios and sides rounded to
+    `multiple`.
+    """
+    aspect = math.exp(sum(math.log(width / height) for width, height in sizes) / len(sizes))
+    target_height = math.sqrt(megapixels * 1024 * 1024 / aspect)
+    target_width = target_height * aspect
+    return (max(multiple, round(target_width / multiple) * multiple),
+            max(multiple, round(target_height / multiple) * multiple))
+
+
+def letterbox(image, canvas_size, fill=0):
+    """
+    Scales an image to fit `canvas_size` without changing its aspect ratio
+    and pads it, centered, with `fill`.
+
+    Returns:
+        tuple: The padded image and the (left, top, right, bottom) box of the
+        image on it, for `unletterbox`.
+    """
+    canvas_width, canvas_height = canvas_size
+    width, height = image.size
+    scale = min(canvas_width / width, canvas_height / height)
+    fitted_width = max(1, round(width * scale))
+    fitted_height = max(1, round(height * scale))
+    left = (canvas_width - fitted_width) // 2
+    top = (canvas_height - fitted_height) // 2
+
+    padded = Image.new(image.mode, canvas_size, fill)
+    padded.paste(image.resize((fitted_width, fitted_height), Image.LANCZOS), (left, top))
+    return padded, (left, top, left + fitted_width, top + fitted_height)
+
+
+def unletterbox(image, box, size):
+    """Crops the `letterbox` box out of an image and scales it back to `size`."""
+    return image.crop(box).resize(size, Image.LANCZOS)
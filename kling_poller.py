@@ -0,0 +1,263 @@
+"""
+Asyncio poller for remote try-on tasks.
+
+Celery workers submit the try-on request and hand the remote task ID to this
+service instead of sleeping in a poll loop. One event loop polls every
+outstanding task concurrently with adaptive backoff, and dispatches
+`tasks.complete_try_on` when a task finishes.
+
+Run it next to the workers:
+    PYTHONPATH=$(pwd) python kling_poller.py
+"""
+import os
+import json
+import time
+import asyncio
+import redis
+import redis.asyncio as aioredis
+
+POLLER_REDIS_URL = os.getenv("POLLER_REDIS_URL", "redis://localhost:6379/0")
+PENDING_QUEUE = "kling_poller:pending"
+IN_FLIGHT_KEY = "kling_poller:in_flight"
+
+redis_client = redis.Redis.from_url(POLLER_REDIS_URL, decode_responses=True)
+
+
+def enqueue(remote_task_id, context):
+    """
+    Hands a submitted remote task to the poller service.
+
+    Args:
+        remote_task_id (str): The task ID returned by the try-on API.
+        context (dict): JSON-serializable data passed back on completion,
+            e.g. the root Celery task ID and the result cache key.
+    """
+    redis_client.rpush(PENDING_QUEUE, json.dumps(
+        {"remote_task_id": remote_task_id, "context": context}))
+
+
+class PendingTask(object):
+    def __init__(self, remote_task_id, context, interval, timeout):
+        now = time.monotonic()
+        self.remote_task_id = remote_task_id
+        self.context = context
+        self.interval = interval
+        self.next_poll = now + interval
+        self.deadline = now + timeout
+        self.status = None
+        self.errors = 0
+        self.polling = False
+
+
+class KlingPoller(object):
+    '''
+    Polls many remote tasks from one event loop.
+
+    `fetch_status(remote_task_id)` is a coroutine returning
+    `(task_status, task_result)`. `on_done(context, task_result, error)` is a
+    coroutine called once per task, with `task_result` None on failure.
+
+    The interval of a task grows by `backoff` on every poll that sees no
+    status change, up to `max_interval`, and resets to `min_interval` when
+    the status changes.
+    '''
+
+    def __init__(self, fetch_status, on_done, on_status=None,
+                 min_interval=1.0, max_interval=15.0, backoff=1.5,
+                 timeout=180.0, max_errors=5, max_concurrency=64):
+        self.fetch_status = fetch_status
+        self.on_done = on_done
+        self.on_status = on_status
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_errors = max_errors
+        self.pending = {}
+        self.polls = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._running = set()
+
+    def submit(self, remote_task_id, context):
+        if remote_task_id in self.pending:
+            return
+        self.pending[remote_task_id] = PendingTask(
+            remote_task_id, context, self.min_interval, self.timeout)
+        self._wakeup.set()
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def run(self):
+        while True:
+            await self.poll_due()
+            await self._sleep_until_next()
+
+    async def poll_due(self):
+        now = time.monotonic()
+        for task in list(self.pending.values()):
+            if task.polling:
+                continue
+            if now >= task.deadline:
+                await self._finish(task, None, "Task did not complete in time")
+            elif now >= task.next_poll:
+                task.polling = True
+                job = asyncio.ensure_future(self._poll(task))
+                self._running.add(job)
+                job.add_done_callback(self._running.discard)
+
+    async def drain(self):
+        """Waits for the polls started so far to finish."""
+        if self._running:
+            await asyncio.gather(*list(self._running))
+
+    async def _sleep_until_next(self):
+        waiting = [task for task in self.pending.values() if not task.polling]
+        delay = self.max_interval
+        if waiting:
+            now = time.monotonic()
+            delay = min(min(task.next_poll, task.deadline) for task in waiting) - now
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.01))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _poll(self, task):
+        try:
+            async with self._semaphore:
+                self.polls += 1
+                status, result = await self.fetch_status(task.remote_task_id)
+        except Exception as e:
+            task.errors += 1
+            print(f"Polling {task.remote_task_id} failed ({task.errors}/{self.max_errors}): {e}")
+            if task.errors >= self.max_errors:
+                await self._finish(task, None, str(e))
+                return
+            self._schedule(task, changed=False)
+            return
+
+        task.errors = 0
+        changed = status != task.status
+        task.status = status
+        if changed and self.on_status is not None:
+            await self.on_status(task.context, status)
+
+        if status == "succeed":
+            await self._finish(task, result, None)
+        elif status == "failed":
+            await self._finish(task, None, "Task failed")
+        else:
+            self._schedule(task, changed)
+
+    def _schedule(self, task, changed):
+        if changed:
+            task.interval = self.min_interval
+        else:
+            task.interval = min(task.interval * self.backoff, self.max_interval)
+        task.next_poll = time.monotonic() + task.interval
+        task.polling = False
+        self._wakeup.set()
+
+    async def _finish(self, task, result, error):
+        if self.pending.pop(task.remote_task_id, None) is None:
+            return
+        self._wakeup.set()
+        try:
+            await self.on_done(task.context, result, error)
+        except Exception as e:
+            print(f"Completion handler for {task.remote_task_id} failed: {e}")
+
+
+async def fetch_kling_status(session, remote_task_id, try_on_url=None, token=None):
+    """
+    Queries a remote task. `try_on_url` and `token` default to the configured
+    API and a valid JWT; the stub accepts any token.
+    """
+    if try_on_url is None or token is None:
+        from try_on import TRY_ON_URL, get_valid_token
+        try_on_url = try_on_url or TRY_ON_URL
+        if token is None:
+            token, _ = await asyncio.to_thread(get_valid_token)
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {token}"
+    }
+    async with session.get(f"{try_on_url}/{remote_task_id}", headers=headers) as response:
+        if response.status != 200:
+            raise RuntimeError(f"Status code {response.status}: {await response.text()}")
+        data = (await response.json()).get("data", {})
+    if not data.get("task_status"):
+        raise RuntimeError("Task status not found in response.")
+    return data["task_status"], data.get("task_result")
+
+
+async def serve():
+    import aiohttp
+    import progress
+    import downloads
+    from celery_app import celery
+
+    client = aioredis.Redis.from_url(POLLER_REDIS_URL, decode_responses=True)
+
+    async def on_status(context, status):
+        await asyncio.to_thread(
+            progress.publish, context["root_task_id"], "try_on", remote_status=status)
+
+    async def on_done(context, result, error):
+        # Stream the result into the output store here, concurrently with the
+        # other polls; complete_try_on downloads it itself if this fails.
+        downloaded = None
+        if result:
+            try:
+                url = result["images"][0]["url"]
+                await asyncio.to_thread(
+                    progress.publish, context["root_task_id"], "downloading")
+                downloaded = await downloads.download_to_store_async(session, url)
+            except (KeyError, IndexError, TypeError) as e:
+                result, error = None, f"Malformed task result: {e!r}"
+            except Exception as e:
+                print(f"Download for {context['remote_task_id']} failed, "
+                      f"complete_try_on will retry it: {e}")
+        # complete_try_on is always dispatched so the root task finishes.
+        # The task stays in flight until the dispatch succeeds, so a failed
+        # dispatch is retried after a restart.
+        await asyncio.to_thread(
+            celery.send_task, "tasks.complete_try_on",
+            args=[result, context["cache_key"], context["root_task_id"], error, downloaded],
+            task_id=context["root_task_id"])
+        await client.hdel(IN_FLIGHT_KEY, context["remote_task_id"])
+
+    def track(item):
+        context = dict(item["context"], remote_task_id=item["remote_task_id"])
+        poller.submit(item["remote_task_id"], context)
+
+    timeout = aiohttp.ClientTimeout(total=30)
+    connector = aiohttp.TCPConnector(limit=64, keepalive_timeout=60)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        poller = KlingPoller(
+            lambda remote_task_id: fetch_kling_status(session, remote_task_id),
+            on_done, on_status)
+
+        # Resume the tasks that were in flight when the service last stopped.
+        for raw in (await client.hgetall(IN_FLIGHT_KEY)).values():
+            track(json.loads(raw))
+
+        runner = asyncio.ensure_future(poller.run())
+        print("Kling poller started")
+        try:
+            while True:
+                item = await client.blpop(PENDING_QUEUE, timeout=5)
+                if item is None:
+                    continue
+                item = json.loads(item[1])
+                await client.hset(IN_FLIGHT_KEY, item["remote_task_id"], json.dumps(item))
+                track(item)
+        finally:
+            runner.cancel()
+            await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
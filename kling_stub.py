@@ -0,0 +1,55 @@
+"""
+Local stand-in for the Kling virtual try-on API.
+
+Tasks succeed `KLING_STUB_DELAY` seconds after submission and their result
+image is the submitted human image. Run it and point the workers at it:
+    uvicorn kling_stub:app --port 8001
+    KLING_API_BASE=http://localhost:8001 ...
+"""
+import os
+import time
+import uuid
+import base64
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+KLING_STUB_DELAY = float(os.getenv("KLING_STUB_DELAY", 10))
+
+app = FastAPI()
+tasks = {}
+
+
+@app.post("/v1/images/kolors-virtual-try-on")
+async def create_task(request: Request):
+    payload = await request.json()
+    task_id = uuid.uuid4().hex
+    tasks[task_id] = {
+        "created": time.time(),
+        "image": base64.b64decode(payload["human_image"]),
+    }
+    return JSONResponse(content={"code": 0, "data": {"task_id": task_id, "task_status": "submitted"}})
+
+
+@app.get("/v1/images/kolors-virtual-try-on/{task_id}")
+async def query_task(task_id: str, request: Request):
+    task = tasks.get(task_id)
+    if task is None:
+        return JSONResponse(content={"code": 1, "message": "Task not found"}, status_code=404)
+    if time.time() - task["created"] < KLING_STUB_DELAY:
+        return JSONResponse(content={"code": 0, "data": {"task_id": task_id, "task_status": "processing"}})
+    ext = "jpg" if task["image"][:2] == b"\xff\xd8" else "png"
+    url = str(request.base_url) + f"stub-images/{task_id}.{ext}"
+    return JSONResponse(content={"code": 0, "data": {
+        "task_id": task_id,
+        "task_status": "succeed",
+        "task_result": {"images": [{"index": 0, "url": url}]},
+    }})
+
+
+@app.get("/stub-images/{task_id}.{ext}")
+async def task_image(task_id: str, ext: str):
+    task = tasks.get(task_id)
+    if task is None:
+        return Response(status_code=404)
+    media_type = "image/jpeg" if ext == "jpg" else "image/png"
+    return Response(content=task["image"], media_type=media_type)
@@ -1,31 +1,106 @@
 import io
 import base64
 import uuid
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
+from typing import Optional
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+import redis.asyncio as aioredis
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from PIL import Image
 from tasks import image_processing  # Import Celery task
+from remove_bg import MAX_IMAGES_PER_PROMPT, resolve_options
 from celery.result import AsyncResult
+import blob_store
+import progress
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+EVENTS_KEEPALIVE_SECONDS = 15
+
+
+
+async def purge_blobs_periodically():
+    """Deletes expired blobs every `PURGE_INTERVAL` seconds, off the event loop."""
+    while True:
+        try:
+            await asyncio.to_thread(blob_store.purge_expired, True)
+        except Exception as e:
+            print(f"Blob purge failed: {e}")
+        await asyncio.sleep(blob_store.PURGE_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    purger = asyncio.create_task(purge_blobs_periodically())
+    try:
+        yield
+    finally:
+        purger.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def store_upload(upload):
+    """
+    Streams an upload into the blob store in fixed-size chunks.
+
+    File I/O runs in a worker thread so the event loop keeps serving other
+    uploads and event streams.
+
+    Args:
+        upload (UploadFile): The uploaded file.
+
+    Returns:
+        str: The blob reference of the stored file.
+    """
+    writer = await asyncio.to_thread(blob_store.BlobWriter)
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await asyncio.to_thread(writer.write, chunk)
+        return await asyncio.to_thread(writer.commit)
+    except Exception:
+        await asyncio.to_thread(writer.abort)
+        raise
 
-app = FastAPI()
 @app.post("/process-two-images/")
 async def process_two_images(
     base_image: UploadFile = File(...),
-    target_image: UploadFile = File(...)
+    target_image: UploadFile = File(...),
+    num_images_per_prompt: Optional[int] = Form(None, ge=1, le=MAX_IMAGES_PER_PROMPT),
+    candidate_index: Optional[int] = Form(None, ge=0, lt=MAX_IMAGES_PER_PROMPT)
 ):
     """
     API endpoint to process two uploaded images asynchronously.
     Args:
         base_image (UploadFile): The base image file.
         target_image (UploadFile): The target image file.
+        num_images_per_prompt (int, optional): Candidates generated per image,
+            1 to MAX_IMAGES_PER_PROMPT (default 1).
+        candidate_index (int, optional): Which generated candidate to keep, below
+            num_images_per_prompt (default 0).
 
     Returns:
         JSONResponse: Contains the task ID if successful or an error message if failed.
     """
+    options = {
+        "num_images_per_prompt": num_images_per_prompt,
+        "candidate_index": candidate_index,
+    }
     try:
-        base_image_bytes = await base_image.read()
-        target_image_bytes = await target_image.read()
-        task = image_processing.delay(base_image_bytes, target_image_bytes)
+        resolve_options(options)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=422)
+
+    try:
+        base_image_ref = await store_upload(base_image)
+        target_image_ref = await store_upload(target_image)
+        task = image_processing.delay(base_image_ref, target_image_ref, options)
         return JSONResponse(content={"task_id": task.id, "message": "Processing started"})
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
@@ -40,12 +115,119 @@ async def get_task_status(task_id: str):
         task_id (str): The unique ID of the Celery task.
 
     Returns:
-        JSONResponse: Contains the task ID, current status, and result (if available).
+        JSONResponse: Contains the task ID, current status, and a reference to the
+        result (if available). The image itself is served by `/results/{task_id}`.
     """
     task_result = AsyncResult(task_id)
 
     return JSONResponse(content={
         "task_id": task_id,
-        "status": task_result.status,  # PENDING, STARTED, SUCCESS, FAILURE
-        "result": task_result.result if task_result.ready() else None
+        "status": task_result.status,  # PENDING, STARTED, PROGRESS, SUCCESS, FAILURE
+        "progress": task_result.info if task_result.status == "PROGRESS" else None,
+        "result": result_reference(task_id, task_result) if task_result.ready() else None
     })
+
+
+@app.get("/task-events/{task_id}")
+async def task_events(task_id: str, request: Request):
+    """
+    Server-Sent Events stream of a task's stage transitions.
+
+    The latest known event is sent first, then every transition as it is
+    published, until the task reaches SUCCESS or FAILURE.
+
+    Args:
+        task_id (str): The unique ID of the Celery task.
+        request (Request): The incoming request, used to detect disconnects.
+
+    Returns:
+        StreamingResponse: A `text/event-stream` of JSON events.
+    """
+    return StreamingResponse(
+        stream_task_events(task_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def sse_message(event):
+    return f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream_task_events(task_id, request):
+    client = aioredis.Redis.from_url(progress.PROGRESS_REDIS_URL, decode_responses=True)
+    pubsub = client.pubsub()
+    try:
+        # Subscribe before reading the latest event so no transition is missed.
+        await pubsub.subscribe(progress.channel(task_id))
+        latest = await client.get(progress.latest_key(task_id))
+        if latest is not None:
+            event = json.loads(latest)
+            yield sse_message(event)
+            if event["stage"] in progress.TERMINAL_STAGES:
+                return
+        else:
+            task_result = AsyncResult(task_id)
+            if task_result.ready():
+                yield sse_message({"task_id": task_id, "stage": task_result.status,
+                                   "result": result_reference(task_id, task_result)})
+                return
+
+        while not await request.is_disconnected():
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=EVENTS_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            event = json.loads(message["data"])
+            yield sse_message(event)
+            if event["stage"] in progress.TERMINAL_STAGES:
+                return
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+
+def result_reference(task_id, task_result):
+    """Builds the compact result reference returned by `/task-status`."""
+    result = task_result.result
+    if not task_result.successful() or not isinstance(result, dict) or "result_ref" not in result:
+        return {"error": str(result)} if task_result.failed() else None
+    return {
+        "result_ref": result["result_ref"],
+        "content_type": result["content_type"],
+        "download_url": f"/results/{task_id}",
+    }
+
+
+@app.get("/results/{task_id}")
+async def download_result(task_id: str, request: Request):
+    """
+    API endpoint to download the result image of a finished task.
+
+    The content-addressed reference doubles as a strong ETag, and Range
+    requests are served by `FileResponse`.
+
+    Args:
+        task_id (str): The unique ID of the Celery task.
+        request (Request): The incoming request, used for `If-None-Match`.
+
+    Returns:
+        FileResponse: The result image, or a JSON error if it is not available.
+    """
+    task_result = AsyncResult(task_id)
+    if not task_result.ready():
+        return JSONResponse(content={"error": "Result not ready"}, status_code=404)
+    reference = result_reference(task_id, task_result)
+    if not reference or "result_ref" not in reference:
+        return JSONResponse(content={"error": "Task has no result"}, status_code=404)
+
+    path = blob_store.blob_path(reference["result_ref"])
+    if not os.path.exists(path):
+        return JSONResponse(content={"error": "Result expired"}, status_code=410)
+
+    etag = f'"{reference["result_ref"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=reference["content_type"], headers=headers)
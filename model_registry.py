@@ -0,0 +1,88 @@
+import importlib
+import threading
+import time
+
+# Model name -> module whose `init()` loads the weights into module globals.
+MODELS = {
+    "captioner": "captioner",
+    "segmenter": "segmenter",
+    "depth_estimator": "depth_estimator",
+    "upscaler": "upscaler",
+    "pipeline": "pipeline",
+}
+
+_loaders = {}
+_locks = {}
+_stats = {}
+_registry_lock = threading.Lock()
+
+
+def register(name, loader):
+    """
+    Registers a loader for a model.
+
+    Args:
+        name (str): The model name used with `ensure`.
+        loader (callable): Loads the model weights. Called at most once.
+    """
+    with _registry_lock:
+        _loaders[name] = loader
+        _locks.setdefault(name, threading.Lock())
+        _stats.setdefault(name, {"loaded": False, "load_seconds": None, "hits": 0})
+
+
+def _default_loader(module_name):
+    def load():
+        importlib.import_module(module_name).init()
+    return load
+
+
+for _name, _module in MODELS.items():
+    register(_name, _default_loader(_module))
+
+
+def ensure(name):
+    """
+    Loads a model once per process and counts every later use as a hit.
+
+    Safe to call from several threads; concurrent callers wait for the
+    first load instead of loading the weights again.
+
+    Args:
+        name (str): The registered model name.
+
+    Raises:
+        KeyError: If no loader is registered under `name`.
+    """
+    stats = _stats[name]
+    if not stats["loaded"]:
+        with _locks[name]:
+            if not stats["loaded"]:
+                _load(name, stats)
+                return
+    with _registry_lock:
+        stats["hits"] += 1
+
+
+def _load(name, stats):
+    print(f"Loading model '{name}'...")
+    start = time.perf_counter()
+    _loaders[name]()
+    stats["load_seconds"] = time.perf_counter() - start
+    stats["loaded"] = True
+    print(f"Loaded model '{name}' in {stats['load_seconds']:.2f}s")
+
+
+def preload(names=None):
+    """Loads the given models, or every registered model, ahead of the first request."""
+    for name in names if names is not None else list(_loaders):
+        ensure(name)
+
+
+def stats():
+    """
+    Returns the load state, load time in seconds and hit count of every model.
+
+    A steady-state worker shows growing hit counts with unchanged load times.
+    """
+    return {name: dict(model_stats) for name, model_stats in _stats.items()}
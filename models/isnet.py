@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 from torchvision import models
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 
 bce_loss = nn.BCELoss(size_average=True)
@@ -71,6 +72,32 @@ class REBNCONV(nn.Module):
 
         return xout
 
+    def fuse(self):
+        """
+        Folds bn_s1 into conv_s1 for inference, leaving Conv2d + ReLU.
+
+        Uses the BatchNorm running statistics, so the block must be in eval
+        mode and must not be trained afterwards.
+        """
+        if isinstance(self.bn_s1, nn.Identity):
+            return
+        self.conv_s1 = fuse_conv_bn_eval(self.conv_s1, self.bn_s1)
+        self.bn_s1 = nn.Identity()
+
+def fuse_conv_bn(model):
+    """
+    Folds the BatchNorm of every REBNCONV block of `model` into its conv.
+
+    Returns:
+        int: The number of blocks fused.
+    """
+    fused = 0
+    for module in model.modules():
+        if isinstance(module, REBNCONV) and not isinstance(module.bn_s1, nn.Identity):
+            module.fuse()
+            fused += 1
+    return fused
+
 ## upsample tensor 'src' to have the same spatial size with tensor 'tar'
 def _upsample_like(src,tar):
 
@@ -490,9 +517,12 @@ class ISNetGTEncoder(nn.Module):
 
 class ISNetDIS(nn.Module):
 
-    def __init__(self,in_ch=3,out_ch=1):
+    def __init__(self,in_ch=3,out_ch=1,inference_only=False):
         super(ISNetDIS,self).__init__()
 
+        # When set, forward() returns only sigmoid(d1), see forward_d1()
+        self.inference_only = inference_only
+
         self.conv_in = nn.Conv2d(in_ch,64,3,stride=2,padding=1)
         self.pool_in = nn.MaxPool2d(2,stride=2,ceil_mode=True)
 
@@ -539,8 +569,40 @@ class ISNetDIS(nn.Module):
         # return muti_loss_fusion(preds,targets)
         return muti_loss_fusion(preds, targets)
 
+    def forward_d1(self,x):
+        """
+        Inference-only forward pass: computes the d1 side output alone.
+
+        Skips side2-side6 and their full-resolution upsamples, and drops each
+        encoder feature map as soon as its decoder stage has consumed it.
+        Returns the (B, out_ch, H, W) sigmoid map, equal to forward(x)[0][0].
+        """
+        hx1 = self.stage1(self.conv_in(x))
+        hx2 = self.stage2(self.pool12(hx1))
+        hx3 = self.stage3(self.pool23(hx2))
+        hx4 = self.stage4(self.pool34(hx3))
+        hx5 = self.stage5(self.pool45(hx4))
+        hx = self.stage6(self.pool56(hx5))
+
+        #-------------------- decoder --------------------
+        hx = self.stage5d(torch.cat((_upsample_like(hx,hx5),hx5),1))
+        del hx5
+        hx = self.stage4d(torch.cat((_upsample_like(hx,hx4),hx4),1))
+        del hx4
+        hx = self.stage3d(torch.cat((_upsample_like(hx,hx3),hx3),1))
+        del hx3
+        hx = self.stage2d(torch.cat((_upsample_like(hx,hx2),hx2),1))
+        del hx2
+        hx = self.stage1d(torch.cat((_upsample_like(hx,hx1),hx1),1))
+        del hx1
+
+        return F.sigmoid(_upsample_like(self.side1(hx),x))
+
     def forward(self,x):
 
+        if self.inference_only:
+            return self.forward_d1(x)
+
         hx = x
 
         hxin = self.conv_in(hx)
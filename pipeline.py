@@ -1,8 +1,20 @@
+import os
+import threading
 import torch
 from diffusers import StableDiffusionXLControlNetPipeline, ControlNetModel, AutoencoderKL, UniPCMultistepScheduler
+from lru_cache import LRUCache
+from batching import MicroBatcher
 torch.multiprocessing.set_start_method('spawn', force=True) 
 device = None
 pipe = None
+# prompt text -> (prompt_embeds, pooled_prompt_embeds) from both SDXL text encoders
+prompt_embeds_cache = LRUCache(int(os.getenv('PROMPT_EMBEDS_CACHE_SIZE', 128)))
+# Micro-batching of concurrent run_pipeline calls (e.g. from a gpu worker with
+# --pool=threads and concurrency > 1). A window of 0 disables it.
+BATCH_WINDOW_MS = float(os.getenv('SDXL_BATCH_WINDOW_MS', 0))
+BATCH_MAX_PROMPTS = int(os.getenv('SDXL_BATCH_MAX_PROMPTS', 4))
+batcher = None
+_batcher_lock = threading.Lock()
 
 
 def init():
@@ -29,7 +41,9 @@ def init():
 
     pipe = StableDiffusionXLControlNetPipeline.from_pretrained(
         "stabilityai/stable-diffusion-xl-base-1.0",
-        controlnet=[depth_controlnet],
+        # A single ControlNet takes a flat list of conditioning images, one
+        # per prompt; MultiControlNetModel rejects batches of them.
+        controlnet=depth_controlnet,
         vae=vae,
         variant="fp16",
         use_safetensors=True,
@@ -44,7 +58,138 @@ def init():
     pipe.enable_xformers_memory_efficient_attention()
 
 
-def run_pipeline(image, positive_prompt, negative_prompt, seed):
+def encode_prompt(text):
+    """
+    Returns `(prompt_embeds, pooled_prompt_embeds)` for a prompt, running the
+    SDXL text encoders only when the text is not in `prompt_embeds_cache`.
+    """
+    cached = prompt_embeds_cache.get(text)
+    if cached is not None:
+        return cached
+
+    with torch.no_grad():
+        prompt_embeds, _, pooled_prompt_embeds, _ = pipe.encode_prompt(
+            prompt=text,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=False,
+        )
+    encoded = (prompt_embeds, pooled_prompt_embeds)
+    prompt_embeds_cache.put(text, encoded)
+    return encoded
+
+
+def encode_prompts(positive_prompt, negative_prompt):
+    """
+    Encodes a prompt pair, or two aligned lists of prompts, through the cache.
+
+    Returns:
+        dict: `prompt_embeds`, `negative_prompt_embeds`, `pooled_prompt_embeds`
+        and `negative_pooled_prompt_embeds`, batched along the first dimension.
+    """
+    if isinstance(positive_prompt, str):
+        positive_prompt = [positive_prompt]
+    if isinstance(negative_prompt, str):
+        negative_prompt = [negative_prompt] * len(positive_prompt)
+
+    positive = [encode_prompt(text) for text in positive_prompt]
+    negative = [encode_prompt(text) for text in negative_prompt]
+    print("Prompt embeddings cache:", prompt_embeds_cache.stats())
+
+    return {
+        "prompt_embeds": torch.cat([embeds for embeds, _ in positive]),
+        "pooled_prompt_embeds": torch.cat([pooled for _, pooled in positive]),
+        "negative_prompt_embeds": torch.cat([embeds for embeds, _ in negative]),
+        "negative_pooled_prompt_embeds": torch.cat([pooled for _, pooled in negative]),
+    }
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _image_sizes(request):
+    return tuple(sorted({image.size for image in _as_list(request["image"])}))
+
+
+def _batch_key(request):
+    # Only calls that would produce the same kind of output share a batch. The
+    # pipeline resizes every conditioning image to the size of the first one,
+    # so the sizes are part of the key.
+    return (request["seed"], request["num_images_per_prompt"], _image_sizes(request))
+
+
+def _run_batch(requests):
+    """Runs several queued run_pipeline calls as one pipeline call and splits the outputs."""
+    sizes = {size for request in requests for size in _image_sizes(request)}
+    assert len(sizes) <= 1, f"Conditioning images of different sizes in one batch: {sorted(sizes)}"
+    positive, negative, counts, images = [], [], [], []
+    for request in requests:
+        prompts = _as_list(request["positive_prompt"])
+        negatives = _as_list(request["negative_prompt"])
+        if len(negatives) == 1:
+            negatives = negatives * len(prompts)
+        positive.extend(prompts)
+        negative.extend(negatives)
+        counts.append(len(prompts))
+        images.extend(_as_list(request["image"]))
+
+    print(f"Running a batch of {len(requests)} requests ({len(positive)} prompts)")
+    num_images_per_prompt = requests[0]["num_images_per_prompt"]
+    generated = _generate(images, positive, negative, requests[0]["seed"], num_images_per_prompt)
+
+    results, start = [], 0
+    for count in counts:
+        end = start + count * num_images_per_prompt
+        results.append(generated[start:end])
+        start = end
+    return results
+
+
+def _get_batcher():
+    global batcher
+    if batcher is None:
+        with _batcher_lock:
+            if batcher is None:
+                batcher = MicroBatcher(
+                    _run_batch,
+                    max_batch_size=BATCH_MAX_PROMPTS,
+                    max_wait=BATCH_WINDOW_MS / 1000.0,
+                    size_of=lambda request: len(_as_list(request["positive_prompt"])),
+                    key_of=_batch_key,
+                )
+    return batcher
+
+
+def run_pipeline(image, positive_prompt, negative_prompt, seed, num_images_per_prompt=1, prompt_embeds=None):
+    """
+    Runs the SDXL ControlNet pipeline.
+
+    `positive_prompt` and `negative_prompt` may be lists to generate a batch in
+    a single call; `image` is then a list of depth conditioning images of one
+    size, aligned with the prompts. The candidates of each prompt are
+    returned contiguously, `num_images_per_prompt` per prompt.
+
+    `prompt_embeds` takes precomputed embeddings in the form returned by
+    `encode_prompts`; otherwise the prompts are encoded through the cache.
+
+    When `SDXL_BATCH_WINDOW_MS` is set, calls made concurrently from other
+    threads within that window are merged into one batched pipeline call.
+    """
+    if BATCH_WINDOW_MS > 0 and prompt_embeds is None:
+        return _get_batcher().submit({
+            "image": image,
+            "positive_prompt": positive_prompt,
+            "negative_prompt": negative_prompt,
+            "seed": seed,
+            "num_images_per_prompt": num_images_per_prompt,
+        })
+    return _generate(image, positive_prompt, negative_prompt, seed, num_images_per_prompt, prompt_embeds)
+
+
+def _generate(image, positive_prompt, negative_prompt, seed, num_images_per_prompt, prompt_embeds=None):
+    if prompt_embeds is None:
+        prompt_embeds = encode_prompts(positive_prompt, negative_prompt)
+
     if seed == -1:
         print("Using random seed")
         generator = None
@@ -53,10 +198,9 @@ def run_pipeline(image, positive_prompt, negative_prompt, seed):
         generator = torch.manual_seed(seed)
 
     images = pipe(
-        prompt=positive_prompt,
-        negative_prompt=negative_prompt,
+        **prompt_embeds,
         num_inference_steps=30,
-        num_images_per_prompt=4,
+        num_images_per_prompt=num_images_per_prompt,
         controlnet_conditioning_scale=0.65,
         guidance_scale=10.0,
         generator=generator,
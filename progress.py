@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import redis
+
+# Stage transitions are published on a per-task Redis channel; the latest
+# event is also kept under a key so late subscribers start from it.
+PROGRESS_REDIS_URL = os.getenv("PROGRESS_REDIS_URL", "redis://localhost:6379/0")
+PROGRESS_TTL = 3600
+CHANNEL_PREFIX = "task_progress:"
+LATEST_PREFIX = "task_progress_latest:"
+TERMINAL_STAGES = ("SUCCESS", "FAILURE")
+
+redis_client = redis.Redis.from_url(PROGRESS_REDIS_URL, decode_responses=True)
+
+
+def channel(task_id):
+    return CHANNEL_PREFIX + task_id
+
+
+def latest_key(task_id):
+    return LATEST_PREFIX + task_id
+
+
+def publish(task_id, stage, **info):
+    """
+    Publishes a stage transition of a task.
+
+    Args:
+        task_id (str): The Celery task ID.
+        stage (str): The stage name, or "SUCCESS" / "FAILURE" when done.
+        **info: Extra JSON-serializable fields such as `step` and `total`.
+
+    Returns:
+        dict: The published event.
+    """
+    event = dict(info, task_id=task_id, stage=stage, time=time.time())
+    message = json.dumps(event)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(latest_key(task_id), message, ex=PROGRESS_TTL)
+        pipe.publish(channel(task_id), message)
+        pipe.execute()
+    except Exception as e:
+        print(f"Progress publish failed: {e}")
+    return event
+
+
+class TaskProgress(object):
+    '''
+    Progress callback handed to the pipeline stages of one Celery task.
+
+    Each call publishes the event and records it as the task's PROGRESS
+    state, so `/task-status` and `/task-events` both see it. Sub-tasks pass
+    the ID of the task the client follows as `task_id`.
+    '''
+
+    def __init__(self, task, task_id=None):
+        self.task = task
+        self.task_id = task_id or task.request.id
+
+    def __call__(self, stage, **info):
+        event = publish(self.task_id, stage, **info)
+        if stage not in TERMINAL_STAGES:
+            try:
+                self.task.update_state(task_id=self.task_id, state="PROGRESS", meta=event)
+            except Exception as e:
+                print(f"Progress state update failed: {e}")
@@ -4,16 +4,72 @@ import numpy as np
 import uuid
 from PIL import Image
 from celery_app import celery
-from background_replacer import replace_background
+from background_replacer import replace_backgrounds
 from face_crop import process_cropping
-   
-def generate_task(base_image_bytes,target_image_bytes):
+
+# Upper bound of `num_images_per_prompt`; each candidate adds to the UNet/VAE batch.
+MAX_IMAGES_PER_PROMPT = 4
+
+DEFAULT_OPTIONS = {
+    'seed': -1,
+    'depth_map_feather_threshold': 128,
+    'depth_map_dilation_iterations': 10,
+    'depth_map_blur_radius': 10,
+    # Fast mode: generate a single candidate per image and keep it.
+    'num_images_per_prompt': 1,
+    'candidate_index': 0,
+}
+
+
+def resolve_options(overrides=None):
+    """
+    Merges request options over `DEFAULT_OPTIONS`.
+
+    Args:
+        overrides (dict, optional): Request options. Unknown keys are ignored.
+
+    Returns:
+        dict: The options used for processing.
+
+    Raises:
+        ValueError: If the candidate options are out of range.
+    """
+    options = dict(DEFAULT_OPTIONS)
+    for key, value in (overrides or {}).items():
+        if key in DEFAULT_OPTIONS and value is not None:
+            options[key] = value
+    if not 1 <= options['num_images_per_prompt'] <= MAX_IMAGES_PER_PROMPT:
+        raise ValueError(f"num_images_per_prompt must be between 1 and {MAX_IMAGES_PER_PROMPT}")
+    if not 0 <= options['candidate_index'] < options['num_images_per_prompt']:
+        raise ValueError(
+            f"candidate_index must be between 0 and num_images_per_prompt - 1 "
+            f"({options['num_images_per_prompt'] - 1})")
+    return options
+
+
+def open_image(data):
+    """
+    Returns an RGB image from bytes, a readable buffer such as a memory-mapped
+    blob, or an already decoded HWC array.
+    """
+    if isinstance(data, np.ndarray):
+        return Image.fromarray(np.asarray(data)).convert("RGB")
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    return Image.open(data).convert("RGB")
+
+
+def generate_task(base_image_bytes,target_image_bytes,options=None,progress=None):
     """
     Processes images by removing backgrounds and refining edges.
 
     Args:
-        base_image_bytes (bytes): Byte data of the base image.
-        target_image_bytes (bytes): Byte data of the target image.
+        base_image_bytes (bytes, file-like or numpy.ndarray): The base image.
+        target_image_bytes (bytes, file-like or numpy.ndarray): The target image.
+        options (dict, optional): Overrides for `DEFAULT_OPTIONS`, e.g.
+            `num_images_per_prompt` and `candidate_index` to choose how many
+            candidates are generated and which one is kept.
+        progress (callable, optional): Stage progress callback passed to `replace_backgrounds`.
 
     Returns:
         Processed base and target image, or an error message on failure.
@@ -22,17 +78,12 @@ def generate_task(base_image_bytes,target_image_bytes):
     positive_prompt="Person, clear edges, detailed face, natural skin tone"
     negative_prompt="Background, blur, noise, shadows, unwanted objects, artifacts"
     try:
-        base_image_pil = Image.open(io.BytesIO(base_image_bytes)).convert("RGB")
-        target_image_pil = Image.open(io.BytesIO(target_image_bytes)).convert("RGB")
-
-        options = {
-            'seed': -1,  
-            'depth_map_feather_threshold': 128,
-            'depth_map_dilation_iterations': 10,
-            'depth_map_blur_radius': 10,
-        }
-        base_results=replace_background(base_image_pil, positive_prompt, negative_prompt, options)
-        target_result = replace_background(target_image_pil, positive_prompt, negative_prompt, options)
+        base_image_pil = open_image(base_image_bytes)
+        target_image_pil = open_image(target_image_bytes)
+
+        options = resolve_options(options)
+        base_results, target_result = replace_backgrounds(
+            [base_image_pil, target_image_pil], positive_prompt, negative_prompt, options, progress)
         base ,target=process_images(target_result,base_results)
         return base,target
 
@@ -54,7 +105,8 @@ def process_images(target_result, base_results):
 
         if not flat_images_target:
             raise ValueError("No valid images returned from replace_background.")
-        result_target = flat_images_target[2] if len(flat_images_target) >=2 else flat_images_target[0]
+        # replace_backgrounds composites only the selected candidate, which comes first.
+        result_target = flat_images_target[0]
         if isinstance(base_results, list):
             for item in base_results:
                 if isinstance(item, list):  
@@ -65,9 +117,8 @@ def process_images(target_result, base_results):
         if not flat_images_base:
             raise ValueError("No valid images returned from replace_background.")
 
-        result_base = flat_images_base[2] if len(flat_images_base) >=2 else flat_images_base[0]
+        result_base = flat_images_base[0]
         return result_base,result_target
 
     except Exception as e:
         return {"error": str(e)}
-
@@ -0,0 +1,54 @@
+import os
+import json
+import redis
+from content_hash import hash_bytes
+
+# Set RESULT_CACHE_TTL=0 to disable the cache.
+RESULT_CACHE_REDIS_URL = os.getenv("RESULT_CACHE_REDIS_URL", "redis://localhost:6379/0")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 24 * 3600))
+RESULT_CACHE_KEY_PREFIX = "tryon_result:"
+
+redis_client = redis.Redis.from_url(RESULT_CACHE_REDIS_URL, decode_responses=True)
+
+
+def result_key(base_image_hash, target_image_hash, options):
+    """
+    Builds the cache key for a try-on request.
+
+    Args:
+        base_image_hash (str): Content hash of the uploaded human image.
+        target_image_hash (str): Content hash of the uploaded cloth image.
+        options (dict): The resolved processing options.
+
+    Returns:
+        str: A key that only depends on the upload contents and the options.
+    """
+    options_json = json.dumps(options, sort_keys=True, separators=(",", ":"))
+    return "{}{}:{}:{}".format(
+        RESULT_CACHE_KEY_PREFIX,
+        base_image_hash,
+        target_image_hash,
+        hash_bytes(options_json.encode("utf-8")),
+    )
+
+
+def get(key):
+    """Returns the stored result for `key`, or None on a miss or Redis error."""
+    if RESULT_CACHE_TTL <= 0:
+        return None
+    try:
+        value = redis_client.get(key)
+    except Exception as e:
+        print(f"Result cache lookup failed: {e}")
+        return None
+    return json.loads(value) if value is not None else None
+
+
+def put(key, result):
+    """Stores a JSON-serializable result under `key` for `RESULT_CACHE_TTL` seconds."""
+    if RESULT_CACHE_TTL <= 0 or result is None:
+        return
+    try:
+        redis_client.set(key, json.dumps(result), ex=RESULT_CACHE_TTL)
+    except Exception as e:
+        print(f"Result cache store failed: {e}")
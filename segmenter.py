@@ -6,11 +6,20 @@ from PIL import Image
 import numpy as np
 import torch
 torch.multiprocessing.set_start_method('spawn', force=True) 
-from torch.autograd import Variable
 from torchvision import transforms
+import torch.nn as nn
 import torch.nn.functional as F
 import matplotlib.pyplot as plt
 
+# "torch" runs ISNet eagerly; "onnx" runs the exported model with
+# onnxruntime on the CPU, see segmenter_onnx.py.
+SEGMENTER_BACKEND = os.getenv("SEGMENTER_BACKEND", "torch")
+# Side of the square model input; smaller sizes trade mask detail for speed.
+SEGMENTER_INPUT_SIZE = int(os.getenv("SEGMENTER_INPUT_SIZE", 1024))
+# "full" (fp32), "half" (bf16 autocast on CPU, fp16 on GPU) or "int8", the
+# CPU model built by segmenter_quant.py.
+SEGMENTER_MODEL_DIGIT = os.getenv("SEGMENTER_MODEL_DIGIT", "full")
+
 device = None
 ISNetDIS = None
 normalize = None
@@ -19,7 +28,7 @@ hypar = None
 net = None
 
 
-def init():
+def init(backend=None):
     global device, ISNetDIS, normalize, im_preprocess, hypar, net
 
     print("Initializing segmenter...")
@@ -38,7 +47,9 @@ def init():
     import models
     import data_loader_cache
 
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    backend = backend or SEGMENTER_BACKEND
+    on_gpu = backend == "torch" and SEGMENTER_MODEL_DIGIT != "int8"
+    device = 'cuda' if torch.cuda.is_available() and on_gpu else 'cpu'
     ISNetDIS = models.ISNetDIS
     normalize = data_loader_cache.normalize
     im_preprocess = data_loader_cache.im_preprocess
@@ -46,13 +57,20 @@ def init():
     hypar["model_path"] = "./saved_models"
     hypar["restore_model"] = "isnet-general-use.pth"
     hypar["interm_sup"] = False
-    hypar["model_digit"] = "full"
+    hypar["model_digit"] = SEGMENTER_MODEL_DIGIT
+    # Half precision keeps BatchNorm as separate fp32 layers instead.
+    hypar["fuse_bn"] = hypar["model_digit"] == "full"
     hypar["seed"] = 0
     hypar["cache_size"] = [1024, 1024]
-    hypar["input_size"] = [1024, 1024]
+    hypar["input_size"] = [SEGMENTER_INPUT_SIZE, SEGMENTER_INPUT_SIZE]
     hypar["crop_size"] = [1024, 1024]
-    hypar["model"] = ISNetDIS()
-    net = build_model(hypar, device)
+    hypar["model"] = ISNetDIS(inference_only=True)
+    if backend == "onnx":
+        net = build_onnx_model(hypar)
+    elif hypar["model_digit"] == "int8":
+        net = build_int8_model(hypar)
+    else:
+        net = build_model(hypar, device)
 
 
 class GOSNormalize(object):
@@ -73,21 +91,55 @@ transform = transforms.Compose(
     [GOSNormalize([0.5, 0.5, 0.5], [1.0, 1.0, 1.0])])
 
 
+def preprocess(images, size, mean=0.5, std=1.0):
+    '''
+    Turns uint8 HWC images into one normalized float32 NCHW batch.
+
+    Equivalent to `im_preprocess` + `torch.divide` + `transform`, but works
+    on zero-copy views of the input arrays, resizes straight into a single
+    preallocated batch and normalizes it in place.
+    '''
+    batch = torch.empty((len(images), 3, size[0], size[1]), dtype=torch.float32)
+    shapes = torch.empty((len(images), 2), dtype=torch.int64)
+    for i, im in enumerate(images):
+        if im.ndim < 3:
+            im = im[:, :, np.newaxis]
+        im = torch.from_numpy(np.ascontiguousarray(im[:, :, :3]))
+        im = im.permute(2, 0, 1).unsqueeze(0).expand(-1, 3, -1, -1).float()
+        batch[i] = F.interpolate(im, size, mode="bilinear", align_corners=False)[0]
+        shapes[i, 0], shapes[i, 1] = im.shape[2], im.shape[3]
+    # The cached training path stores the resized image as uint8.
+    batch.floor_().div_(255.0).sub_(mean).div_(std)
+    return batch, shapes
+
+
 def load_image(im_pil, hypar):
-    im = np.array(im_pil)
-    im, im_shp = im_preprocess(im, hypar["cache_size"])
-    im = torch.divide(im, 255.0)
-    shape = torch.from_numpy(np.array(im_shp))
-    return transform(im).unsqueeze(0), shape.unsqueeze(0)
+    return preprocess([np.asarray(im_pil)], hypar["input_size"])
+
+
+def autocast_dtype(device):
+    return torch.float16 if device == 'cuda' else torch.bfloat16
+
+
+def _float_inputs(module, inputs):
+    return tuple(x.float() for x in inputs)
+
+
+def keep_norm_fp32(net):
+    '''
+    Makes every BatchNorm of `net` run on fp32 inputs under autocast, so
+    only the convolutions run in reduced precision. The weights stay fp32.
+    '''
+    for layer in net.modules():
+        if isinstance(layer, nn.BatchNorm2d):
+            layer.register_forward_pre_hook(_float_inputs)
+    return net
 
 
 def build_model(hypar, device):
     net = hypar["model"]
     if (hypar["model_digit"] == "half"):
-        net.half()
-        for layer in net.modules():
-            if isinstance(layer, nn.BatchNorm2d):
-                layer.float()
+        keep_norm_fp32(net)
 
     net.to(device)
 
@@ -96,6 +148,60 @@ def build_model(hypar, device):
             hypar["model_path"]+"/"+hypar["restore_model"], map_location=device))
         net.to(device)
     net.eval()
+    if hypar.get("fuse_bn"):
+        net = fuse_model(net, device)
+    return net
+
+
+def build_int8_model(hypar):
+    '''
+    Loads the INT8 model written by segmenter_quant.py.
+    '''
+    import segmenter_quant
+
+    path = segmenter_quant.INT8_PATH
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{path} not found, run segmenter_quant.py to calibrate the INT8 segmenter")
+    return segmenter_quant.load(path)
+
+
+def build_onnx_model(hypar):
+    '''
+    Loads the exported ISNet into onnxruntime, exporting it first if needed.
+    '''
+    import segmenter_onnx
+
+    path = segmenter_onnx.ONNX_PATH
+    if not os.path.exists(path):
+        segmenter_onnx.export(build_model(hypar, 'cpu'), path, hypar["input_size"])
+    return segmenter_onnx.OnnxSegmenter(segmenter_onnx.load_session(path))
+
+
+def _d1(output):
+    # The d1 mask batch, from an inference-only or a full ISNetDIS forward.
+    return output if torch.is_tensor(output) else output[0][0]
+
+
+def fuse_model(net, device, size=256, atol=1e-4):
+    '''
+    Folds the BatchNorm of every REBNCONV block into its convolution.
+
+    The fused model is checked against the unfused one on a random input;
+    if they disagree by more than `atol`, the unfused model is kept.
+    '''
+    import copy
+    import models
+
+    reference = copy.deepcopy(net)
+    fused = models.fuse_conv_bn(net)
+    x = torch.rand(1, 3, size, size, device=device) - 0.5
+    with torch.no_grad():
+        diff = (_d1(reference(x)) - _d1(net(x))).abs().max().item()
+    if diff > atol:
+        print(f"Conv+BatchNorm fusion changed the output by {diff:.2e}, keeping the unfused model")
+        return reference
+    print(f"Fused {fused} Conv+BatchNorm pairs (max abs diff {diff:.2e})")
     return net
 
 
@@ -105,23 +211,16 @@ def predict(net, inputs_val, shapes_val, hypar, device):
     '''
     net.eval()
 
-    if (hypar["model_digit"] == "full"):
-        inputs_val = inputs_val.type(torch.FloatTensor)
-    else:
-        inputs_val = inputs_val.type(torch.HalfTensor)
-
-    inputs_val_v = Variable(inputs_val, requires_grad=False).to(
-        device)  
-    ds_val = net(inputs_val_v)[0] 
-    pred_val = ds_val[0][0, :, :, :]
-    pred_val = torch.squeeze(F.upsample(torch.unsqueeze(
-        pred_val, 0), (shapes_val[0][0], shapes_val[0][1]), mode='bilinear'))
+    half = hypar["model_digit"] == "half"
+    with torch.no_grad(), torch.autocast(device, dtype=autocast_dtype(device), enabled=half):
+        ds_val = net(inputs_val.to(device))
+    pred_val = _d1(ds_val)[0, :, :, :].float()
+    pred_val = torch.squeeze(F.interpolate(torch.unsqueeze(
+        pred_val, 0), (int(shapes_val[0][0]), int(shapes_val[0][1])), mode='bilinear'))
 
     ma = torch.max(pred_val)
     mi = torch.min(pred_val)
     pred_val = (pred_val-mi)/(ma-mi) 
-    if device == 'cuda':
-        torch.cuda.empty_cache()
     return (pred_val.detach().cpu().numpy()*255).astype(np.uint8)
 
 
@@ -0,0 +1,97 @@
+"""
+ONNX export and onnxruntime CPU backend for the ISNet segmenter.
+
+Export the restored model once (segmenter.init also does it when the file
+is missing and SEGMENTER_BACKEND=onnx):
+    PYTHONPATH=$(pwd) python segmenter_onnx.py [--output saved_models/isnet-general-use.onnx]
+"""
+import os
+import argparse
+import torch
+
+ONNX_PATH = os.getenv("SEGMENTER_ONNX_PATH", "./saved_models/isnet-general-use.onnx")
+# 0 lets onnxruntime use one thread per physical core.
+INTRA_OP_THREADS = int(os.getenv("SEGMENTER_ONNX_THREADS", 0))
+OPSET = 17
+
+
+def export(net, path, size, opset=OPSET):
+    """
+    Exports an inference-only ISNetDIS to ONNX.
+
+    Args:
+        net (ISNetDIS): The restored model, built with `inference_only=True`.
+        path (str): The output file.
+        size (list): The [height, width] of the example input; the exported
+            graph accepts any batch size and input size.
+        opset (int): The ONNX opset version.
+
+    Returns:
+        str: The output file.
+    """
+    net = net.cpu().float().eval()
+    dummy = torch.zeros(1, 3, size[0], size[1])
+    with torch.no_grad():
+        torch.onnx.export(
+            net, dummy, path,
+            input_names=["image"], output_names=["mask"],
+            dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"},
+                          "mask": {0: "batch", 2: "height", 3: "width"}},
+            opset_version=opset, do_constant_folding=True)
+    print(f"Exported segmenter to {path}")
+    return path
+
+
+def load_session(path, threads=INTRA_OP_THREADS):
+    """
+    Opens an onnxruntime CPU session with all graph optimizations enabled.
+
+    Args:
+        path (str): The exported model.
+        threads (int): Intra-op thread count, 0 for the onnxruntime default.
+
+    Returns:
+        onnxruntime.InferenceSession: The session.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+class OnnxSegmenter(object):
+    '''
+    Runs the exported ISNet with onnxruntime.
+
+    Called like the inference-only torch model: takes a float32 NCHW batch
+    and returns the d1 mask batch as a tensor, so `segmenter.predict` works
+    with either backend.
+    '''
+
+    inference_only = True
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    def __call__(self, batch):
+        output = self.session.run(None, {self.input_name: batch.contiguous().numpy()})[0]
+        return torch.from_numpy(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the ISNet segmenter to ONNX.")
+    parser.add_argument("--output", default=ONNX_PATH)
+    parser.add_argument("--opset", type=int, default=OPSET)
+    args = parser.parse_args()
+
+    import segmenter
+    segmenter.init(backend="torch")
+    export(segmenter.net, args.output, segmenter.hypar["input_size"], args.opset)
@@ -0,0 +1,236 @@
+"""
+INT8 static post-training quantization of the ISNet segmenter for CPU serving.
+
+Calibrate on a folder of images, write the quantized model and print its
+accuracy, latency and size against the fp32 model:
+    PYTHONPATH=$(pwd) python segmenter_quant.py --im-dir path/to/images
+
+Then serve it with SEGMENTER_MODEL_DIGIT=int8.
+"""
+import os
+import io
+import sys
+import copy
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from itertools import islice
+import torch
+
+INT8_PATH = os.getenv("SEGMENTER_INT8_PATH", "./saved_models/isnet-general-use-int8.pt")
+QUANT_ENGINE = "x86"
+
+
+def load_fp32(weights):
+    import models
+
+    net = models.ISNetDIS(inference_only=True)
+    net.load_state_dict(torch.load(weights, map_location="cpu"))
+    return net.eval()
+
+
+def image_loader(im_dir, size, cache_dir, im_ext=".jpg", gt_dir="", gt_ext=".png"):
+    """
+    Loads a folder of images through `data_loader_cache.GOSDatasetCache`,
+    preprocessed and normalized the way the segmenter feeds ISNet.
+
+    Returns:
+        torch.utils.data.DataLoader: Batches of one sample.
+    """
+    import data_loader_cache
+
+    datasets = [{"name": "calibration", "im_dir": im_dir, "gt_dir": gt_dir, "im_ext": im_ext,
+                 "gt_ext": gt_ext, "cache_dir": cache_dir}]
+    name_im_gt_list = data_loader_cache.get_im_gt_name_dict(datasets, flag="valid")
+    loaders, _ = data_loader_cache.create_dataloaders(
+        name_im_gt_list, cache_size=size, cache_boost=False,
+        my_transforms=[data_loader_cache.GOSNormalize([0.5, 0.5, 0.5], [1.0, 1.0, 1.0])])
+    return loaders[0]
+
+
+def quantize(net, samples, engine=QUANT_ENGINE):
+    """
+    Statically quantizes an fp32 ISNetDIS to INT8 with FX graph mode.
+
+    Conv+BatchNorm+ReLU are fused by `prepare_fx`, so `net` must not have
+    been through `models.fuse_conv_bn`.
+
+    Args:
+        net (ISNetDIS): The fp32 model, built with `inference_only=True`.
+        samples (iterable): Calibration samples from `image_loader`.
+        engine (str): The quantized engine, "x86" or "qnnpack".
+
+    Returns:
+        torch.fx.GraphModule: The quantized model.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = engine
+    samples = iter(samples)
+    first = next(samples)["image"]
+
+    prepared = prepare_fx(copy.deepcopy(net).cpu().eval(), get_default_qconfig_mapping(engine), (first,))
+    calibrated = 0
+    with torch.no_grad():
+        for image in [first] + [sample["image"] for sample in samples]:
+            prepared(image)
+            calibrated += 1
+    print(f"Calibrated on {calibrated} images")
+    return convert_fx(prepared)
+
+
+def save(qnet, path):
+    torch.jit.save(torch.jit.script(qnet), path)
+    print(f"Saved INT8 segmenter to {path}")
+    return path
+
+
+def load(path, engine=QUANT_ENGINE):
+    torch.backends.quantized.engine = engine
+    return torch.jit.load(path, map_location="cpu").eval()
+
+
+def mask_metrics(reference, candidate, threshold=0.5):
+    """
+    Returns the IoU of the thresholded masks and the mean absolute error of
+    the soft masks.
+    """
+    ref, cand = reference > threshold, candidate > threshold
+    union = (ref | cand).sum().item()
+    iou = (ref & cand).sum().item() / union if union else 1.0
+    return iou, (reference - candidate).abs().mean().item()
+
+
+def _latency(net, image, runs):
+    with torch.no_grad():
+        net(image)
+        start = time.perf_counter()
+        for _ in range(runs):
+            net(image)
+    return (time.perf_counter() - start) / runs
+
+
+def _serialized_size(net):
+    buffer = io.BytesIO()
+    if isinstance(net, torch.jit.ScriptModule):
+        torch.jit.save(net, buffer)
+    else:
+        torch.save(net.state_dict(), buffer)
+    return buffer.tell()
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(kind, weights, int8_path, image_path, runs):
+    """
+    Loads one model in this process and runs it on a saved input.
+
+    Returns:
+        dict: Latency, serialized size, the process RSS before the model was
+        loaded and its peak after inference.
+    """
+    baseline = _rss_mb()
+    net = load_fp32(weights) if kind == "fp32" else load(int8_path)
+    image = torch.load(image_path)
+    return {
+        "latency": _latency(net, image, runs),
+        "bytes": _serialized_size(net),
+        "baseline_rss_mb": baseline,
+        "peak_rss_mb": _rss_mb(),
+    }
+
+
+def _measure_in_subprocess(kind, weights, int8_path, image_path, runs):
+    command = [sys.executable, os.path.abspath(__file__), "--measure", kind, "--weights", weights,
+               "--output", int8_path, "--input", image_path, "--runs", str(runs)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(fp32, int8, samples, weights, int8_path, runs=5):
+    """
+    Compares the INT8 model with the fp32 one.
+
+    Mask IoU and MAE are measured on the d1 output of every sample. Latency
+    (mean over `runs` passes on the first sample), serialized size and peak
+    RSS are measured for each model in its own process, so the memory
+    figures do not include the other model.
+
+    Returns:
+        dict: The report.
+    """
+    ious, maes, first = [], [], None
+    with torch.no_grad():
+        for sample in samples:
+            image = sample["image"]
+            first = image if first is None else first
+            iou, mae = mask_metrics(fp32(image), int8(image))
+            ious.append(iou)
+            maes.append(mae)
+
+    image_path = os.path.join(tempfile.mkdtemp(), "input.pt")
+    torch.save(first, image_path)
+    full = _measure_in_subprocess("fp32", weights, int8_path, image_path, runs)
+    quantized = _measure_in_subprocess("int8", weights, int8_path, image_path, runs)
+
+    result = {
+        "images": len(ious),
+        "mean_iou": sum(ious) / len(ious),
+        "min_iou": min(ious),
+        "mean_mae": sum(maes) / len(maes),
+        "fp32": full,
+        "int8": quantized,
+    }
+
+    print(f"Images compared:   {result['images']}")
+    print(f"Mask IoU (>0.5):   mean {result['mean_iou']:.4f}, min {result['min_iou']:.4f}")
+    print(f"Mask MAE:          {result['mean_mae']:.5f}")
+    print(f"Latency fp32:      {full['latency'] * 1000:8.1f} ms/image")
+    print(f"Latency int8:      {quantized['latency'] * 1000:8.1f} ms/image "
+          f"({full['latency'] / quantized['latency']:.2f}x)")
+    print(f"Weights fp32:      {full['bytes'] / 2**20:8.1f} MiB")
+    print(f"Weights int8:      {quantized['bytes'] / 2**20:8.1f} MiB")
+    for name, stats in (("fp32", full), ("int8", quantized)):
+        print(f"Peak RSS {name}:     {stats['peak_rss_mb']:8.1f} MiB "
+              f"(+{stats['peak_rss_mb'] - stats['baseline_rss_mb']:.1f} MiB over the bare process)")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize the ISNet segmenter to INT8.")
+    parser.add_argument("--im-dir", help="Folder of calibration and evaluation images.")
+    parser.add_argument("--im-ext", default=".jpg")
+    parser.add_argument("--cache-dir", default="./cache/segmenter_calibration")
+    parser.add_argument("--weights", default="./saved_models/isnet-general-use.pth")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--calibration", type=int, default=32, help="Images used for calibration.")
+    parser.add_argument("--eval", type=int, default=16, help="Held-out images used for the report.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", default=INT8_PATH)
+    # Internal: measure one model in a fresh process, see report().
+    parser.add_argument("--measure", choices=["fp32", "int8"], help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.weights, args.output, args.input, args.runs)))
+        sys.exit(0)
+    if not args.im_dir:
+        parser.error("--im-dir is required")
+
+    fp32 = load_fp32(args.weights)
+    loader = image_loader(args.im_dir, [args.size, args.size], args.cache_dir, args.im_ext)
+    int8 = quantize(fp32, islice(loader, args.calibration))
+    save(int8, args.output)
+
+    held_out = list(islice(loader, args.calibration, args.calibration + args.eval))
+    if not held_out:
+        print("No held-out images left, reporting on the calibration images")
+        held_out = list(islice(loader, args.eval))
+    report(fp32, load(args.output), held_out, args.weights, args.output, args.runs)
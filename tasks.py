@@ -2,28 +2,199 @@ import io
 import os,cv2
 import numpy as np 
 import uuid
+from contextlib import contextmanager
 from PIL import Image
+from celery import chain
+from celery.exceptions import Ignore
+from celery.signals import worker_init
 from celery_app import celery
+import model_registry
 from face_crop import process_cropping
-from remove_bg import generate_task
-from try_on import final_segmentation
+import result_cache
+import blob_store
+import progress
+from image_utils import maybe_downscale
+from remove_bg import generate_task, open_image, resolve_options
+import kling_poller
+from try_on import final_segmentation, request_task_id, store_result
+
+# Set PRELOAD_MODELS=0 on workers that only consume the cpu or io queues.
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "1") != "0"
+MEGAPIXELS = 1.0
+# With the poller, remote waits happen in `kling_poller` instead of a worker slot.
+USE_KLING_POLLER = os.getenv("USE_KLING_POLLER", "1") != "0"
+
+
+@worker_init.connect
+def preload_models(**kwargs):
+    """Loads every model once when the worker starts so requests reuse resident weights."""
+    if not PRELOAD_MODELS:
+        return
+    model_registry.preload()
+    print("Model registry:", model_registry.stats())
+
+
+@contextmanager
+def reporting_failures(report):
+    try:
+        yield
+    except Ignore:
+        # Not a failure: the task handed its result off, e.g. to `kling_poller`.
+        raise
+    except Exception as e:
+        report("FAILURE", error=str(e))
+        raise
+
 
 @celery.task(bind=True)
-def image_processing(self,base_image_bytes,target_image_bytes):
+def image_processing(self,base_image_ref,target_image_ref,options=None):
     """
     Processes an image by performing background removal, face cropping, and segmentation.
 
+    Runs on the `cpu` queue and replaces itself with a chain of sub-tasks, each
+    routed to its own queue (see `celery_app.TASK_ROUTES`).
+
     Args:
         self: The Celery task instance.
-        base_image_bytes (bytes): The byte representation of the base image.
-        target_image_bytes (bytes): The byte representation of the target image.
+        base_image_ref (str): Blob store reference of the base image.
+        target_image_ref (str): Blob store reference of the target image.
+        options (dict, optional): Request options passed to `generate_task`.
 
     Workflow:
-        1. `generate_task`: Removes the background from the images and returns processed base and target images.
-        2. `process_cropping`: Crops the face from the target image.
-        3. `final_segmentation`: Performs final segmentation on the processed images.
+        1. `image_processing` (cpu): Checks the result cache, decodes and downscales the uploads.
+        2. `generate_backgrounds` (gpu): Removes the background from the images with `generate_task`.
+        3. `try_on_images` (io): Crops the face from the target image and runs `final_segmentation`.
+
+    Identical submissions are answered from `result_cache` without running any model
+    or calling the try-on API. Stage transitions are pushed through `progress`, always
+    under this task's ID, which also receives the final result.
+
+    Returns:
+        dict or None: A compact reference to the result in the output store.
+    """
+    report = progress.TaskProgress(self)
+    with reporting_failures(report):
+        options = resolve_options(options)
+        # Blob references are content hashes, so they key the cache directly.
+        cache_key = result_cache.result_key(base_image_ref, target_image_ref, options)
+        cached = result_cache.get(cache_key)
+        if cached is not None and os.path.exists(blob_store.blob_path(cached["result_ref"])):
+            print("Result cache hit:", cache_key)
+            report("SUCCESS", result=cached)
+            return cached
+
+        report("decoding")
+        image_refs = [decode_upload(ref) for ref in (base_image_ref, target_image_ref)]
+
+    raise self.replace(chain(
+        generate_backgrounds.s(image_refs, options, self.request.id),
+        try_on_images.s(cache_key, self.request.id),
+    ))
+
+
+def decode_upload(ref):
+    """Decodes an uploaded image, downscales it to the working resolution and stores the RGB array."""
+    blob = blob_store.open_blob(ref)
+    try:
+        image = open_image(blob)
+    finally:
+        blob.close()
+    image = maybe_downscale(image, megapixels=MEGAPIXELS)
+    return blob_store.put_array(np.asarray(image))
+
+
+@celery.task(bind=True)
+def generate_backgrounds(self,image_refs,options,root_task_id):
     """
-    base_image,target_image=generate_task(base_image_bytes,target_image_bytes)
-    target_image=process_cropping(target_image)
-    final_segmentation(base_image,target_image)
+    Model inference stage: background replacement for the decoded base and target images.
 
+    Args:
+        image_refs (list[str]): Array blob references of the base and target images.
+        options (dict): The resolved request options.
+        root_task_id (str): ID of the `image_processing` task clients follow.
+
+    Returns:
+        list[str]: Array blob references of the processed base and target images.
+    """
+    report = progress.TaskProgress(self, root_task_id)
+    with reporting_failures(report):
+        base_array, target_array = [blob_store.open_array(ref) for ref in image_refs]
+        result = generate_task(base_array, target_array, options, report)
+        # Steady state: hit counts grow while load times stay unchanged.
+        print("Model registry:", model_registry.stats())
+        if isinstance(result, dict):
+            raise RuntimeError(result.get("error"))
+        base_image, target_image = result
+        return [blob_store.put_array(np.asarray(image)) for image in (base_image, target_image)]
+
+
+@celery.task(bind=True)
+def try_on_images(self,image_refs,cache_key,root_task_id):
+    """
+    External API stage: face cropping and the remote try-on request.
+
+    Args:
+        image_refs (list[str]): Array blob references of the processed base and target images.
+        cache_key (str): The result cache key of the request.
+        root_task_id (str): ID of the `image_processing` task clients follow.
+
+    Returns:
+        dict: A compact reference to the result in the output store.
+
+    Raises:
+        RuntimeError: If the try-on failed, so the task is recorded as FAILURE.
+    """
+    report = progress.TaskProgress(self, root_task_id)
+    with reporting_failures(report):
+        base_image, target_image = [Image.fromarray(blob_store.open_array(ref)) for ref in image_refs]
+        report("face_crop")
+        target_image=process_cropping(target_image)
+        if USE_KLING_POLLER:
+            report("try_on_request")
+            remote_task_id, _, _ = request_task_id(base_image, target_image)
+            if not remote_task_id:
+                raise RuntimeError("Failed to obtain task ID.")
+            kling_poller.enqueue(remote_task_id, {"root_task_id": root_task_id, "cache_key": cache_key})
+            report("try_on", remote_status="submitted")
+            # `complete_try_on` stores the result under the root task ID.
+            raise Ignore()
+        result = final_segmentation(base_image,target_image,report)
+        if not result:
+            # Raising makes Celery record FAILURE, matching the published event.
+            raise RuntimeError("Try-on did not return a result.")
+        result_cache.put(cache_key, result)
+    report("SUCCESS", result=result)
+    return result
+
+
+@celery.task(bind=True)
+def complete_try_on(self,task_result,cache_key,root_task_id,error=None,downloaded=None):
+    """
+    Downstream step dispatched by `kling_poller` once the remote task finishes.
+
+    Runs under the root task ID, so its return value is the request's result.
+
+    Args:
+        task_result (dict or None): The remote `task_result`, None on failure.
+        cache_key (str): The result cache key of the request.
+        root_task_id (str): ID of the `image_processing` task clients follow.
+        error (str, optional): Why the remote task failed.
+        downloaded (list, optional): (blob reference, content type) of the result image
+            if the poller already streamed it into the output store.
+
+    Returns:
+        dict: A compact reference to the result in the output store.
+
+    Raises:
+        RuntimeError: If the try-on failed, so the task is recorded as FAILURE.
+    """
+    report = progress.TaskProgress(self, root_task_id)
+    with reporting_failures(report):
+        if task_result is None:
+            raise RuntimeError(error or "Task did not complete successfully.")
+        result = store_result(task_result, report, downloaded)
+        if not result:
+            raise RuntimeError("Failed to store the try-on result.")
+        result_cache.put(cache_key, result)
+    report("SUCCESS", result=result)
+    return result
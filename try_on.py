@@ -1,11 +1,12 @@
 import redis
 import time
+import threading
 import jwt
 import os
-import requests
-import base64
-from io import BytesIO
 from dotenv import load_dotenv
+import http_client
+import downloads
+from image_encoding import encode_image, StreamingJSONBody
 
 load_dotenv()
 
@@ -17,6 +18,10 @@ redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_
 sk = os.environ.get("SECRET_KEY")
 ak = os.environ.get("ACCESS_KEY")
 
+# Point KLING_API_BASE at `kling_stub` to run without the real API.
+KLING_API_BASE = os.environ.get("KLING_API_BASE", "https://api.klingai.com")
+TRY_ON_URL = f"{KLING_API_BASE}/v1/images/kolors-virtual-try-on"
+
 def encode_jwt_token():
     """Generate a new JWT token with a 30-minute expiry."""
     headers = {"alg": "HS256", "typ": "JWT"}
@@ -25,22 +30,53 @@ def encode_jwt_token():
     token = jwt.encode(payload, sk, algorithm="HS256", headers=headers)
     return token, payload["exp"]
 
+# Process-local token cache. Tokens are refreshed TOKEN_REFRESH_MARGIN seconds
+# before expiry, so polling never hits Redis while the cached token is fresh.
+TOKEN_REFRESH_MARGIN = 120
+TOKEN_REDIS_KEY = "jwt_token_bundle"
+_token_cache = {"token": None, "expiry": 0.0}
+_token_lock = threading.Lock()
+
+
+def _token_fresh(expiry):
+    return time.time() < expiry - TOKEN_REFRESH_MARGIN
+
+
 def get_valid_token():
-    """Retrieve token from Redis if valid, otherwise generate a new one."""
-    token = redis_client.get("jwt_token")
-    expiry = redis_client.get("jwt_expiry")
-    if token and expiry and time.time() < float(expiry):
-        return token, float(expiry)
-    
-    token, expiry = encode_jwt_token()
-    redis_client.set("jwt_token", token, ex=1800)
-    redis_client.set("jwt_expiry", expiry, ex=1800)
-    return token, expiry
+    """
+    Return a valid token from the process cache, then Redis, otherwise generate a new one.
+
+    Only one thread refreshes at a time; the others wait for its result.
+    Redis is read and written with a single command each, storing the
+    token and its expiry together.
+    """
+    token, expiry = _token_cache["token"], _token_cache["expiry"]
+    if token and _token_fresh(expiry):
+        return token, expiry
+
+    with _token_lock:
+        token, expiry = _token_cache["token"], _token_cache["expiry"]
+        if token and _token_fresh(expiry):
+            return token, expiry
 
-def pil_to_base64(pil_image):
-    buffer = BytesIO()
-    pil_image.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+        try:
+            bundle = redis_client.get(TOKEN_REDIS_KEY)
+        except Exception as e:
+            print(f"Token lookup failed: {e}")
+            bundle = None
+        if bundle:
+            token, expiry = bundle.rsplit("|", 1)
+            expiry = float(expiry)
+        if not bundle or not _token_fresh(expiry):
+            token, expiry = encode_jwt_token()
+            try:
+                redis_client.set(TOKEN_REDIS_KEY, f"{token}|{expiry}",
+                                 ex=max(int(expiry - time.time()), 1))
+            except Exception as e:
+                print(f"Token store failed: {e}")
+
+        _token_cache["token"], _token_cache["expiry"] = token, expiry
+        return token, expiry
 
 def request_task_id(base, target):
     """
@@ -48,28 +84,26 @@ def request_task_id(base, target):
 
     Args:
         base (PIL.Image.Image): The base (human) image.
-        target (str): Base64-encoded clothing image.
+        target (PIL.Image.Image or numpy.ndarray): The clothing image, RGB.
 
     Returns:
         tuple: (task_id, token, expiry) if successful, otherwise (None, token, expiry).
     """
 
-    url = "https://api.klingai.com/v1/images/kolors-virtual-try-on"  
+    url = TRY_ON_URL
     token, expiry = get_valid_token()   
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {token}"
     }
-    human_image_base64 = pil_to_base64(base)          
-    cloth_image_base64 = target 
-    
-    payload = {
+    # Encoded once each; base64 is produced while the body is streamed.
+    payload = StreamingJSONBody({
         "model_name": "kolors-virtual-try-on-v1-5",
-        "human_image": human_image_base64,
-        "cloth_image": cloth_image_base64  
-    }
+        "human_image": encode_image(base),
+        "cloth_image": encode_image(target),
+    })
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, data=payload, headers=headers)
     if response.status_code != 200:
         print("Error requesting task_id:", response.status_code, response.text)
         return None, token, expiry
@@ -81,20 +115,23 @@ def request_task_id(base, target):
         print("Unexpected response format:", response_json)
         return None, token, expiry
 
-def query_task_status(task_id):
+def query_task_status(task_id, progress=None):
     """
     Polls the API to check the status of a segmentation task.
 
     Args:
         task_id (str): The unique identifier of the task.
+        progress (callable, optional): Called as `progress("try_on", ...)` whenever
+            the remote task status changes.
 
     Returns:
         dict or None: The task result if successful, None if the task fails or times out.
     """
     
-    url = f"https://api.klingai.com/v1/images/kolors-virtual-try-on/{task_id}"
+    url = f"{TRY_ON_URL}/{task_id}"
     max_attempts = 60
     attempts = 0
+    last_status = None
     while attempts < max_attempts:
         token, _ = get_valid_token()
         headers = {
@@ -102,7 +139,7 @@ def query_task_status(task_id):
             "Authorization": f"Bearer {token}"
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = http_client.get(url, headers=headers)
         except Exception as e:
             print(f"Exception during request: {e}")
             return None
@@ -116,6 +153,9 @@ def query_task_status(task_id):
             print("Task status not found in response.")
             return None
         print(f"Task Status: {task_status}") 
+        if progress is not None and task_status != last_status:
+            progress("try_on", remote_status=task_status, attempt=attempts + 1)
+        last_status = task_status
         if task_status == "succeed":
             return result["data"]["task_result"]
         elif task_status == "failed":
@@ -126,51 +166,75 @@ def query_task_status(task_id):
     print("Maximum polling attempts reached. Task did not complete in time.")
     return None
 
-def download_image(image_url, save_folder):
-    if not os.path.exists(save_folder):
-        os.makedirs(save_folder)
-    ext = os.path.splitext(image_url)[-1].split('?')[0] 
-    if not ext:
-        ext = ".png"
-
-    filename = f"final_image{ext}"
-    save_path = os.path.join(save_folder, filename)
-    if os.path.exists(save_path):
-        os.remove(save_path)
-
-    response = requests.get(image_url)
-    if response.status_code == 200:
-        with open(save_path, "wb") as file:
-            file.write(response.content)
-        print(f"Image successfully downloaded: {save_path}")
-    else:
-        print(f"Failed to download image. Status code: {response.status_code}")
+def download_image(image_url):
+    """
+    Streams the try-on result into the content-addressed output store.
 
-def final_segmentation(base, target):
+    Args:
+        image_url (str): The result image URL returned by the API.
+
+    Returns:
+        tuple: (blob reference, content type), or None if the download failed.
+    """
+    downloaded = downloads.download_to_store(image_url)
+    if downloaded:
+        print(f"Image successfully downloaded: {downloaded[0]}")
+        print("HTTP client:", http_client.stats())
+    return downloaded
+
+def final_segmentation(base, target, progress=None):
     """
     Performs the final segmentation process and saves the segmented image.
 
     Args:
         base (str or bytes): The base image data or path.
         target (str or bytes): The target image data or path.
+        progress (callable, optional): Stage progress callback.
 
     Workflow:
         1. Requests a task ID for segmentation.
         2. Checks the task status.
         3. Retrieves the segmented image URL upon task completion.
-        4. Downloads and saves the segmented image in the "segmented_image" folder.
+        4. Downloads the segmented image into the output store.
 
     Returns:
-        None
+        dict or None: The output store reference (`result_ref`), its
+        `content_type` and the remote `image_url`, or None on failure.
     """
-    save_folder = "segmented_image"
+    if progress is not None:
+        progress("try_on_request")
     task_id, _, _ = request_task_id(base, target)
     if task_id:
-        result = query_task_status(task_id)
+        result = query_task_status(task_id, progress)
         if result:
-            image_url = result['images'][0]['url']
-            download_image(image_url, save_folder)
+            return store_result(result, progress)
         else:
             print("Task did not complete successfully.")
     else:
         print("Failed to obtain task ID.")
+    return None
+
+
+def store_result(task_result, progress=None, downloaded=None):
+    """
+    Downloads the image of a finished remote task into the output store.
+
+    Args:
+        task_result (dict): The `task_result` of a succeeded remote task.
+        progress (callable, optional): Stage progress callback.
+        downloaded (list, optional): (blob reference, content type) when the
+            image was already downloaded, e.g. by `kling_poller`.
+
+    Returns:
+        dict or None: The output store reference (`result_ref`), its
+        `content_type` and the remote `image_url`, or None on failure.
+    """
+    image_url = task_result['images'][0]['url']
+    if not downloaded:
+        if progress is not None:
+            progress("downloading")
+        downloaded = download_image(image_url)
+    if downloaded:
+        ref, content_type = downloaded
+        return {"result_ref": ref, "content_type": content_type, "image_url": image_url}
+    return None